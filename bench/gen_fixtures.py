@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# gen_fixtures.py
+# generate a synthetic input set for the pipeline scripts
+# Topology (CAIDA as-rel2 format) with a tiered structure:
+#   tier 1: a clique of peering transit ASes
+#   tier 2: transit ASes buying from tier 1 or earlier tier 2 ASes, and
+#           peering among themselves
+#   stubs:  1 or more providers in tier 2, a few stub-stub peerings
+# --density scales the number of peerings and providers per AS.
+# Output ([out_dir]):
+# data/topology.txt, data/clients.txt, data/as_guard.txt, data/guard_as_bw.json,
+# data/top50ases.txt, data/cc_asn.json, data/cg_hijack_as.json,
+# data/traces/trace[i].txt, cr/cc_asn.json
+# and empty result_files/ and cr/dat_files/, so that vanilla scripts run from
+# [out_dir] and counter-raptor scripts from [out_dir]/cr.
+##################################################
+
+import os
+import json
+import random
+import argparse
+import datetime
+
+
+def gen_topology(num_ases, density, rnd):
+    asns = rnd.sample(range(1, 400000), num_ases)
+    num_t1 = max(3, min(15, num_ases // 500))
+    num_t2 = max(num_t1, num_ases // 10)
+    t1 = asns[:num_t1]
+    t2 = asns[num_t1:num_t1+num_t2]
+    stubs = asns[num_t1+num_t2:]
+    max_prov = 1 + max(1, int(round(2 * density)))
+
+    edges = {}
+    def add(a, b, rel):
+        # rel -1: a is a provider of b; 0: a and b peer
+        key = (min(a, b), max(a, b))
+        if a != b and key not in edges:
+            edges[key] = (a, b, rel)
+
+    for i in range(len(t1)):
+        for j in range(i+1, len(t1)):
+            add(t1[i], t1[j], 0)
+    # providers only come from higher tiers (earlier in the list): no cycles
+    for i, a in enumerate(t2):
+        uplinks = t1 + t2[:i]
+        for p in rnd.sample(uplinks, min(len(uplinks), rnd.randint(1, max_prov))):
+            add(p, a, -1)
+    for a in t2:
+        for b in rnd.sample(t2, min(len(t2), int(round(3 * density)))):
+            add(a, b, 0)
+    for a in stubs:
+        for p in rnd.sample(t2, min(len(t2), rnd.randint(1, max_prov))):
+            add(p, a, -1)
+        if stubs and rnd.random() < 0.05 * density:
+            add(a, rnd.choice(stubs), 0)
+
+    lines = list(edges.values())
+    rnd.shuffle(lines)
+    degree = dict((a, 0) for a in asns)
+    for a, b, rel in lines:
+        degree[a] += 1
+        degree[b] += 1
+    return t1 + t2, stubs, lines, degree
+
+def gen_trace(codes, length, rnd):
+    # a user moving between a few home locations and some random ones
+    homes = rnd.sample(codes, min(len(codes), 3))
+    start = datetime.datetime(2016, 1, 1) + datetime.timedelta(seconds=rnd.randint(0, 300 * 86400))
+    rows = []
+    for _ in range(length):
+        code = rnd.choice(homes) if rnd.random() < 0.7 else rnd.choice(codes)
+        ts = start + datetime.timedelta(seconds=rnd.randint(0, 60 * 86400))
+        rows.append("%s %s" % (code, ts.strftime("%Y-%m-%d %H:%M:%S")))
+    # a location without an AS, skipped by the country scripts
+    rows.append("zz %s" % start.strftime("%Y-%m-%d %H:%M:%S"))
+    return rows
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out_dir", default="bench/work/small")
+    parser.add_argument("--num_ases", type=int, default=2000)
+    parser.add_argument("--density", type=float, default=1.0)
+    parser.add_argument("--num_clients", type=int, default=50)
+    parser.add_argument("--num_guards", type=int, default=100)
+    parser.add_argument("--num_traces", type=int, default=20)
+    parser.add_argument("--trace_len", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+def main(args):
+    rnd = random.Random(args.seed)
+    data = os.path.join(args.out_dir, 'data')
+    for d in [data, os.path.join(data, 'traces'), os.path.join(args.out_dir, 'result_files'),
+              os.path.join(args.out_dir, 'cr', 'dat_files')]:
+        os.makedirs(d, exist_ok=True)
+
+    transit, stubs, lines, degree = gen_topology(args.num_ases, args.density, rnd)
+    with open(os.path.join(data, 'topology.txt'), 'w') as fp:
+        fp.write("# synthetic tiered topology, %d ASes, density %g, seed %d\n"
+                 % (args.num_ases, args.density, args.seed))
+        for a, b, rel in lines:
+            fp.write("%d|%d|%d|bgp\n" % (a, b, rel))
+
+    clients = [str(a) for a in rnd.sample(stubs, min(len(stubs), args.num_clients))]
+    taken = set(clients)
+    pool = [a for a in transit + stubs if str(a) not in taken]
+    guards = [str(a) for a in rnd.sample(pool, min(len(pool), args.num_guards))]
+    topas = [str(a) for a in sorted(transit, key=lambda a: -degree[a])[:50]]
+    with open(os.path.join(data, 'clients.txt'), 'w') as fp:
+        fp.write(''.join([c + '\n' for c in clients]))
+    with open(os.path.join(data, 'as_guard.txt'), 'w') as fp:
+        fp.write(''.join([g + '\n' for g in guards]))
+    with open(os.path.join(data, 'top50ases.txt'), 'w') as fp:
+        fp.write(''.join([a + '\n' for a in topas]))
+    with open(os.path.join(data, 'guard_as_bw.json'), 'w') as fp:
+        json.dump(dict((g, rnd.randint(100, 100000)) for g in guards), fp)
+
+    # one location code per client AS
+    cc_asn = dict(("cc%d" % i, c) for i, c in enumerate(clients))
+    for filename in [os.path.join(data, 'cc_asn.json'), os.path.join(args.out_dir, 'cr', 'cc_asn.json')]:
+        with open(filename, 'w') as fp:
+            json.dump(cc_asn, fp)
+
+    # hijack_dict: {client: {guard: [as1,as2,...]}} drawn from the top ASes
+    hijack = {}
+    for c in clients:
+        hijack[c] = dict((g, rnd.sample(topas, rnd.randint(0, min(8, len(topas))))) for g in guards)
+    with open(os.path.join(data, 'cg_hijack_as.json'), 'w') as fp:
+        json.dump(hijack, fp)
+
+    codes = list(cc_asn.keys())
+    for i in range(args.num_traces):
+        with open(os.path.join(data, 'traces', 'trace%d.txt' % i), 'w') as fp:
+            fp.write(''.join([r + '\n' for r in gen_trace(codes, args.trace_len, rnd)]))
+
+    print("%d ASes, %d links, %d clients, %d guards, %d traces in %s"
+          % (args.num_ases, len(lines), len(clients), len(guards), args.num_traces, args.out_dir))
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# run_bench.py
+# time the pipeline scripts on synthetic inputs at several scales
+# For every scale, fixtures are generated with gen_fixtures.py (once, into
+# [work_dir]/[scale]) and each step runs as its own process:
+#   predictpath, resilience, guard_as_country (--batch over all traces),
+#   counterraptor_client_country (one trace)
+# Output:
+# JSON baseline (--out, default bench/baseline.json):
+# {"host": {...}, "scales": {scale: fixture parameters},
+#  "results": {scale: {step: {"wall": s, "cpu": s, "maxrss_kb": kB}}}}
+# With --compare [baseline], steps slower than --tolerance times the
+# baseline wall time (and by more than --min_delta seconds, to ignore noise
+# on short steps) are reported and the exit status is 1.
+##################################################
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# fixture parameters of each scale
+SCALES = {
+    "small":  {"num_ases": 2000,  "num_clients": 30,  "num_guards": 60,  "num_traces": 20,  "trace_len": 30},
+    "medium": {"num_ases": 10000, "num_clients": 100, "num_guards": 200, "num_traces": 100, "trace_len": 50},
+    "large":  {"num_ases": 40000, "num_clients": 300, "num_guards": 600, "num_traces": 500, "trace_len": 100},
+}
+
+# step: (working directory relative to the fixtures, script, arguments)
+STEPS = [
+    ("predictpath", ".", "vanilla/predictpath.py",
+     ["--topology_file", "data/topology.txt", "--client_file", "data/clients.txt",
+      "--guard_as_file", "data/as_guard.txt"]),
+    ("resilience", "cr", "counter-raptor/counter_raptor_resilience.py",
+     ["--topology_file", "../data/topology.txt", "--client_file", "../data/clients.txt",
+      "--guard_as_file", "../data/as_guard.txt"]),
+    ("guard_as_country", ".", "vanilla/guard_as_country.py",
+     ["--client_path", "data/cg_path.json", "--guard_path", "data/guard_as_bw.json",
+      "--topas_file", "data/top50ases.txt", "--batch", "data/traces"]),
+    ("client_country", "cr", "counter-raptor/counterraptor_client_country.py",
+     ["--guard_file", "../data/guard_as_bw.json", "--resil_file", "../data/cg_resilience.json",
+      "--hijack_file", "../data/cg_hijack_as.json", "--client_file", "../data/traces/trace0.txt"]),
+]
+
+def run(cmd, cwd, log):
+    # wall time, CPU time and peak RSS of one process (and its workers)
+    start = time.time()
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.time() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        print("%s failed (exit %d), see %s" % (' '.join(cmd), proc.returncode, log.name))
+        sys.exit(1)
+    return {"wall": round(wall, 4), "cpu": round(usage.ru_utime + usage.ru_stime, 4),
+            "maxrss_kb": usage.ru_maxrss}
+
+def bench_scale(scale, args):
+    params = dict(SCALES[scale], density=args.density, seed=args.seed)
+    work = os.path.join(args.work_dir, scale)
+    stamp = os.path.join(work, 'params.json')
+    if not os.path.exists(stamp) or json.load(open(stamp, 'r')) != params:
+        cmd = [sys.executable, os.path.join(BENCH_DIR, 'gen_fixtures.py'), "--out_dir", work]
+        for k in sorted(params):
+            cmd += ["--" + k, str(params[k])]
+        subprocess.check_call(cmd)
+        with open(stamp, 'w') as fp:
+            json.dump(params, fp)
+
+    results = {}
+    with open(os.path.join(work, 'bench.log'), 'w') as log:
+        for step, cwd, script, script_args in STEPS:
+            cmd = [sys.executable, os.path.join(REPO_DIR, script)] + script_args
+            if step in ("predictpath", "resilience", "guard_as_country") and args.workers > 1:
+                cmd += ["--workers", str(args.workers)]
+            best = None
+            for _ in range(args.repeat):
+                res = run(cmd, os.path.join(work, cwd), log)
+                if best is None or res["wall"] < best["wall"]:
+                    best = res
+            results[step] = best
+            print("%-8s %-18s wall %8.3fs  cpu %8.3fs  rss %8d kB"
+                  % (scale, step, best["wall"], best["cpu"], best["maxrss_kb"]))
+    return params, results
+
+def compare(baseline, current, tolerance, min_delta):
+    # steps whose wall time grew beyond the tolerance
+    slower = []
+    for scale in sorted(current):
+        for step in current[scale]:
+            old = baseline.get("results", {}).get(scale, {}).get(step)
+            if not old or old["wall"] <= 0:
+                continue
+            wall = current[scale][step]["wall"]
+            ratio = wall / old["wall"]
+            worse = ratio > tolerance and wall - old["wall"] > min_delta
+            print("%-8s %-18s %8.3fs -> %8.3fs  x%.2f%s"
+                  % (scale, step, old["wall"], wall, ratio, "  SLOWER" if worse else ""))
+            if worse:
+                slower.append((scale, step))
+    return slower
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", nargs='+', choices=sorted(SCALES), default=["small", "medium"])
+    parser.add_argument("--density", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per step, the fastest one is kept")
+    parser.add_argument("--work_dir", default=os.path.join(BENCH_DIR, 'work'))
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, 'baseline.json'))
+    parser.add_argument("--compare", default=None,
+                        help="baseline to compare with instead of writing --out")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument("--min_delta", type=float, default=0.25,
+                        help="seconds a step must lose before it counts as slower")
+    return parser.parse_args()
+
+def main(args):
+    scales = {}
+    results = {}
+    for scale in args.scales:
+        scales[scale], results[scale] = bench_scale(scale, args)
+
+    if args.compare:
+        slower = compare(json.load(open(args.compare, 'r')), results, args.tolerance,
+                         args.min_delta)
+        if slower:
+            print("%d steps slower than x%g of the baseline" % (len(slower), args.tolerance))
+            sys.exit(1)
+        return
+
+    host = {"platform": platform.platform(), "python": platform.python_version(),
+            "cpus": os.cpu_count(), "workers": args.workers, "repeat": args.repeat}
+    with open(args.out, 'w') as fp:
+        json.dump({"host": host, "scales": scales, "results": results}, fp, indent=1, sort_keys=True)
+    print("baseline written to %s" % args.out)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# bitsets.py
+# AS sets packed into bytes, bit i of byte i >> 3 for AS i (little endian),
+# as used by the adversary and hijacker masks of the country scripts
+# Usage:
+#   counts = popcount(np.bitwise_or.accumulate(masks, axis=0))
+##################################################
+
+import numpy as np
+
+
+# set bits of every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+# BITS[v][j]: bit j of byte value v
+BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1, bitorder='little').astype(bool)
+
+
+# size of each packed set (the last axis holds the bytes)
+def popcount(packed):
+    return POPCOUNT[packed].sum(axis=-1)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# guardsim.py
+# Monte Carlo guard selection for mobile clients (--simulate in the country scripts)
+# Every simulated user picks a guard by the guard weights at the first
+# location of a trace and is watched by one adversary drawn uniformly from
+# the adversary ASes. The user is compromised at the first location whose
+# on-path (or hijacker) set of its guard contains its adversary, so the
+# fraction compromised by location t estimates the expected risk curve.
+# Usage:
+#   first = first_exposure(masks, first_loc, num_adv, len(clientlst))
+#   counts, picks = simulate(weights, first, len(clientlst), num_users, seed)
+# counts[t]: users first compromised at location t, counts[-1]: never
+# picks[g]: users that picked guard g
+# Users are drawn in chunks of chunk users; guard and adversary draws come
+# from separate streams, so the results only depend on the seed.
+##################################################
+
+import numpy as np
+
+
+# first[g][a]: first location at which adversary a sees the circuits to
+# guard g (never if it does not). masks are the packed adversary bits of the
+# distinct clients of a trace, (clients, guards, bytes), in order of their
+# first location first_loc; later visits of a client add no adversaries.
+def first_exposure(masks, first_loc, num_adv, never):
+    masks = np.asarray(masks, dtype=np.uint8)
+    bits = np.unpackbits(masks, axis=-1, bitorder='little')[..., :num_adv].astype(bool)
+    if bits.shape[-1] < num_adv:
+        # adversaries that are never on a path
+        pad = np.zeros(bits.shape[:-1] + (num_adv - bits.shape[-1],), dtype=bool)
+        bits = np.concatenate([bits, pad], axis=-1)
+    if bits.shape[0] == 0:
+        return np.full(bits.shape[1:], never, dtype=np.int64)
+    first_loc = np.asarray(first_loc, dtype=np.int64)
+    return np.where(bits.any(axis=0), first_loc[bits.argmax(axis=0)], never)
+
+def simulate(weights, first, num_locations, num_users, seed=0, chunk=1 << 20):
+    weights = np.asarray(weights, dtype=np.float64)
+    if not weights.sum() > 0:
+        raise ValueError("guard weights sum to 0")
+    cw = np.cumsum(weights)
+    cw /= cw[-1]
+    num_guards, num_adv = first.shape
+    if num_adv == 0:
+        raise ValueError("no adversary ASes")
+    guard_rng, adv_rng = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(2)]
+    counts = np.zeros(num_locations + 1, dtype=np.int64)
+    picks = np.zeros(num_guards, dtype=np.int64)
+    for start in range(0, num_users, chunk):
+        n = min(chunk, num_users - start)
+        # inverse CDF: guard g for u in [cw[g-1], cw[g]), zero weights are never picked
+        g = np.minimum(np.searchsorted(cw, guard_rng.random(n), side='right'), num_guards - 1)
+        a = (adv_rng.random(n) * num_adv).astype(np.int64)
+        counts += np.bincount(first[g, a], minlength=num_locations + 1)
+        picks += np.bincount(g, minlength=num_guards)
+    return counts, picks
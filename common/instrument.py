@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# instrument.py
+# opt-in run statistics for the pipeline scripts (--stats [file])
+# Output:
+# JSON lines appended to the stats file, one object per record:
+# {"event": "root", "phase": ..., "root": ..., "wall", "cpu", "nodes", "edges", "paths"}
+#   work of one BFS root (computed in the worker that ran it)
+# {"event": "phase", "phase": ..., "wall", "cpu", "maxrss_kb", "children_maxrss_kb",
+#  "roots", "nodes", "edges", "paths", "root_wall", "root_cpu", ...}
+#   one phase (load, forward, reverse, tiebreak, resilience, dump, ...) with
+#   the sums of its roots; cpu includes worker processes that have exited
+# {"event": "run", "wall", "cpu", "maxrss_kb", "children_maxrss_kb"}
+#   the whole run, written by close()
+# Every record also has "script" and "pid" (of the worker for root records). Without a stats file all calls
+# do nothing.
+##################################################
+
+import os
+import json
+import time
+import resource
+
+
+def usage():
+    # wall time, CPU time of this process and its waited-for children, peak RSS
+    me = resource.getrusage(resource.RUSAGE_SELF)
+    ch = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (time.time(), me.ru_utime + me.ru_stime + ch.ru_utime + ch.ru_stime,
+            me.ru_maxrss, ch.ru_maxrss)
+
+
+class Stats(object):
+    def __init__(self, filename, script):
+        self.fp = open(filename, 'a') if filename else None
+        self.script = script
+        self.phase = None
+        self.counts = None
+        self.start = usage()
+
+    def __bool__(self):
+        return self.fp is not None
+
+    def emit(self, record):
+        if self.fp is None:
+            return
+        record = dict(record)
+        record.setdefault("script", self.script)
+        record.setdefault("pid", os.getpid())
+        self.fp.write(json.dumps(record, sort_keys=True) + '\n')
+        self.fp.flush()
+
+    def record(self, event, start, **fields):
+        end = usage()
+        fields.update(event=event, wall=round(end[0] - start[0], 6), cpu=round(end[1] - start[1], 6),
+                      maxrss_kb=end[2], children_maxrss_kb=end[3])
+        self.emit(fields)
+
+    def begin(self, name):
+        # start a phase, ending the previous one
+        if self.fp is None:
+            return
+        self.end()
+        self.phase = (name, usage())
+        self.counts = {}
+
+    def end(self):
+        if self.fp is None or self.phase is None:
+            return
+        (name, start), counts = self.phase, self.counts
+        self.phase = None
+        self.counts = None
+        for k in counts:
+            if isinstance(counts[k], float):
+                counts[k] = round(counts[k], 6)
+        self.record("phase", start, phase=name, **counts)
+
+    def add(self, **counts):
+        # add to the counters of the current phase
+        if self.counts is not None:
+            for k in counts:
+                self.counts[k] = self.counts.get(k, 0) + counts[k]
+
+    def root(self, root, work):
+        # work of one root: {"wall", "cpu", "nodes", "edges", "paths", ...}
+        if self.fp is None or work is None:
+            return
+        self.emit(dict(work, event="root", phase=self.phase[0] if self.phase else None, root=root))
+        sums = dict((k, v) for k, v in work.items() if k not in ("wall", "cpu", "pid"))
+        self.add(roots=1, root_wall=work["wall"], root_cpu=work["cpu"], **sums)
+
+    def close(self):
+        if self.fp is None:
+            return
+        self.end()
+        self.record("run", self.start)
+        self.fp.close()
+        self.fp = None
+
+
+# timer for the work of one root, inside a worker
+def clock():
+    return (time.time(), time.process_time())
+
+def elapsed(start):
+    return {"wall": round(time.time() - start[0], 6), "cpu": round(time.process_time() - start[1], 6),
+            "pid": os.getpid()}
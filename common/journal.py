@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# journal.py
+# append-only per-root result journal for resumable runs (--journal, --resume)
+# Layout:
+# magic, then records: key length, value length, crc32 (of key and value),
+# pickled key, pickled value. The first record has key None and holds the
+# identity of the run (inputs and settings); a journal is only resumed by a
+# run with the same identity.
+# Records are fsync'd at least every sync_interval seconds and on close().
+# A record torn by a crash fails its length or crc check and is cut off on
+# resume, so at most the roots of the last sync_interval are computed again.
+# Only the offsets of the records are kept in memory; values are read back
+# one at a time with get().
+# append_parts(key, values) writes a list whose items are pickled separately
+# (count, item offsets, items) and read back one by one with get_part(key, i),
+# e.g. one row of a per-root result in the order of another root set.
+##################################################
+
+import os
+import sys
+import time
+import zlib
+import pickle
+import struct
+from array import array
+
+
+MAGIC = b'ROOTJRN1'
+RECORD = struct.Struct('<III')
+COUNT = struct.Struct('<Q')
+
+
+class Journal(object):
+    def __init__(self, filename, identity, resume=False, sync_interval=10.0):
+        self.filename = filename
+        self.sync_interval = sync_interval
+        self.offsets = {} # key -> offset of its record
+        self.tables = {}  # key -> (start of its items, item offsets) of parts records
+        if resume and os.path.exists(filename):
+            self.fp = open(filename, 'r+b')
+            if self.scan() != identity:
+                self.fp.close()
+                raise ValueError("%s was written by a run with other inputs" % filename)
+        else:
+            self.fp = open(filename, 'w+b')
+            self.fp.write(MAGIC)
+            self.write(None, pickle.dumps(identity, pickle.HIGHEST_PROTOCOL))
+        self.sync()
+
+    def write(self, key, v):
+        k = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+        self.fp.seek(0, os.SEEK_END)
+        pos = self.fp.tell()
+        self.fp.write(RECORD.pack(len(k), len(v), zlib.crc32(v, zlib.crc32(k))) + k + v)
+        return pos
+
+    def read(self, pos):
+        # (key, value bytes, end) of the record at pos, None if it is torn
+        self.fp.seek(pos)
+        head = self.fp.read(RECORD.size)
+        if len(head) < RECORD.size:
+            return None
+        klen, vlen, crc = RECORD.unpack(head)
+        k = self.fp.read(klen)
+        v = self.fp.read(vlen)
+        if len(k) < klen or len(v) < vlen or zlib.crc32(v, zlib.crc32(k)) != crc:
+            return None
+        return pickle.loads(k), v, pos + RECORD.size + klen + vlen
+
+    def scan(self):
+        # identity of the journal; complete records are indexed, a torn tail is cut off
+        self.fp.seek(0)
+        if self.fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a journal" % self.filename)
+        pos = len(MAGIC)
+        rec = self.read(pos)
+        if rec is None or rec[0] is not None:
+            raise ValueError("%s has no identity record" % self.filename)
+        identity = pickle.loads(rec[1])
+        pos = rec[2]
+        while True:
+            rec = self.read(pos)
+            if rec is None:
+                break
+            self.offsets[rec[0]] = pos
+            pos = rec[2]
+        self.fp.seek(pos)
+        self.fp.truncate()
+        return identity
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, key, value):
+        self.offsets[key] = self.write(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if time.time() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def append_parts(self, key, values):
+        items = [pickle.dumps(value, pickle.HIGHEST_PROTOCOL) for value in values]
+        table = array('Q', [0])
+        for v in items:
+            table.append(table[-1] + len(v))
+        if sys.byteorder != 'little':
+            table.byteswap()
+        self.offsets[key] = self.write(key, COUNT.pack(len(items)) + table.tobytes() + b''.join(items))
+        if time.time() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def get(self, key):
+        return pickle.loads(self.read(self.offsets[key])[1])
+
+    def get_part(self, key, i):
+        # item i of a parts record, without reading the others
+        if key not in self.tables:
+            pos = self.offsets[key]
+            self.fp.seek(pos)
+            klen = RECORD.unpack(self.fp.read(RECORD.size))[0]
+            self.fp.seek(pos + RECORD.size + klen)
+            n = COUNT.unpack(self.fp.read(COUNT.size))[0]
+            table = array('Q')
+            table.frombytes(self.fp.read(8 * (n + 1)))
+            if sys.byteorder != 'little':
+                table.byteswap()
+            self.tables[key] = (pos + RECORD.size + klen + COUNT.size + 8 * (n + 1), table)
+        start, table = self.tables[key]
+        self.fp.seek(start + table[i])
+        return pickle.loads(self.fp.read(table[i+1] - table[i]))
+
+    def sync(self):
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.last_sync = time.time()
+
+    def close(self):
+        self.sync()
+        self.fp.close()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# pathstore.py
+# compact binary format for predicted client/guard paths (cg_path.json)
+# Layout (little endian, offsets 8-byte aligned):
+# header: magic, version, flags, n_names, n_clients, n_guards, n_paths, n_hops
+# pair_off[n_clients*n_guards*2+1]  paths of (client, guard, forward/reverse)
+# path_off[n_paths+1]               hops of each path
+# clients[n_clients], guards[n_guards], hops[n_hops]  (ids into the names)
+# names                             interned ASNs, newline separated
+# Reader:
+# PathStore(filename) mmaps the file and decodes only the pairs asked for.
+# store[client][guard] has the same shape as cg_path.json, and
+# store.on_path(client, guard) gives the set of ASes on both paths.
+##################################################
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+
+MAGIC = b'CGPATHS1'
+VERSION = 1
+FLAG_TIEBREAK = 1
+HEADER = struct.Struct('<8sIIIIIQQ4x')
+
+
+def is_pathstore(filename):
+    with open(filename, 'rb') as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+def write(filename, client_dict, tiebreak=True):
+    # client_dict: {client: {guard: [forward, reverse]}} as dumped to cg_path.json,
+    # with one path per direction when tiebreak is set and a list of paths otherwise
+    guards = {}
+    for cl in client_dict:
+        guards.update(dict.fromkeys(client_dict[cl]))
+    return write_items(filename, client_dict.items(), list(guards), tiebreak)
+
+def write_items(filename, items, guards, tiebreak=True):
+    # (client, {guard: [forward, reverse]}) pairs of a client_dict, packed as
+    # they come so that only the packed arrays are kept in memory
+    seen = {} # ASes on the paths, by first appearance
+    def intern(asn):
+        if asn not in seen:
+            seen[asn] = len(seen)
+        return seen[asn]
+
+    clients = []
+    pair_off = array('Q', [0])
+    path_off = array('Q', [0])
+    hops = array('I')
+    for cl, entry in items:
+        clients.append(cl)
+        for g in guards:
+            routes = entry.get(g, [[], []])
+            for d in range(2):
+                paths = routes[d]
+                if tiebreak:
+                    paths = [paths] if paths else []
+                for p in paths:
+                    hops.extend([intern(x) for x in p])
+                    path_off.append(len(hops))
+                pair_off.append(len(path_off) - 1)
+    if not clients:
+        guards = []
+    # names are numbered clients first, then guards, then the other ASes
+    names = dict.fromkeys(clients + guards)
+    for asn in seen:
+        names.setdefault(asn)
+    names = dict(zip(names, range(len(names))))
+    remap = [names[asn] for asn in seen]
+    hops = array('I', [remap[x] for x in hops])
+    client_ids = array('I', [names[c] for c in clients])
+    guard_ids = array('I', [names[g] for g in guards])
+
+    blob = '\n'.join(names.keys()).encode('utf-8')
+    parts = [pair_off, path_off, client_ids, guard_ids, hops]
+    if sys.byteorder != 'little':
+        for p in parts:
+            p.byteswap()
+    tmpfile = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmpfile, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, FLAG_TIEBREAK if tiebreak else 0,
+                             len(names), len(clients), len(guards),
+                             len(path_off) - 1, len(hops)))
+        for p in parts:
+            p.tofile(fp)
+        fp.write(blob)
+    os.replace(tmpfile, filename)
+    return len(clients)
+
+
+class ClientPaths(object):
+    # lazy {guard: [forward, reverse]} view of one client
+    def __init__(self, store, ci):
+        self.store = store
+        self.ci = ci
+
+    def __iter__(self):
+        return iter(self.store.guards)
+
+    def __len__(self):
+        return len(self.store.guards)
+
+    def __contains__(self, guard):
+        return guard in self.store.gindex
+
+    def __getitem__(self, guard):
+        return self.store.pair(self.ci, self.store.gindex[guard])
+
+    def keys(self):
+        return list(self.store.guards)
+
+
+class PathStore(object):
+    def __init__(self, filename):
+        fp = open(filename, 'rb')
+        try:
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+        magic, version, flags, n_names, n_clients, n_guards, n_paths, n_hops = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a path store" % filename)
+        self.tiebreak = bool(flags & FLAG_TIEBREAK)
+        self.n_guards = n_guards
+        view = memoryview(buf)
+        off = HEADER.size
+        arrays = []
+        for code, size in [('Q', n_clients * n_guards * 2 + 1), ('Q', n_paths + 1),
+                           ('I', n_clients), ('I', n_guards), ('I', n_hops)]:
+            width = struct.calcsize(code)
+            arrays.append(view[off:off+width*size].cast(code))
+            off += width * size
+        if sys.byteorder != 'little':
+            arrays = [array(a.format, a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        self.pair_off, self.path_off, client_ids, guard_ids, self.hops = arrays
+        self.names = bytes(view[off:]).decode('utf-8').split('\n') if n_names else []
+        self.clients = [self.names[i] for i in client_ids]
+        self.guards = [self.names[i] for i in guard_ids]
+        self.cindex = dict(zip(self.clients, range(n_clients)))
+        self.gindex = dict(zip(self.guards, range(n_guards)))
+
+    def __contains__(self, client):
+        return client in self.cindex
+
+    def __iter__(self):
+        return iter(self.clients)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __getitem__(self, client):
+        return ClientPaths(self, self.cindex[client])
+
+    def keys(self):
+        return list(self.clients)
+
+    def path_ids(self, ci, gi, d):
+        pos = (ci * self.n_guards + gi) * 2 + d
+        return range(self.pair_off[pos], self.pair_off[pos+1])
+
+    def path(self, p):
+        names = self.names
+        return [names[x] for x in self.hops[self.path_off[p]:self.path_off[p+1]]]
+
+    def pair(self, ci, gi):
+        res = []
+        for d in range(2):
+            paths = [self.path(p) for p in self.path_ids(ci, gi, d)]
+            if self.tiebreak:
+                paths = paths[0] if paths else []
+            res.append(paths)
+        return res
+
+    def on_path(self, client, guard):
+        # ASes on the forward and reverse paths between client and guard
+        ci = self.cindex[client]
+        gi = self.gindex[guard]
+        names = self.names
+        ases = set()
+        for d in range(2):
+            for p in self.path_ids(ci, gi, d):
+                ases.update([names[x] for x in self.hops[self.path_off[p]:self.path_off[p+1]]])
+        return ases
+
+
+def load(filename):
+    # a PathStore for binary files, the parsed dict for cg_path.json
+    if is_pathstore(filename):
+        return PathStore(filename)
+    import json
+    return json.load(open(filename, 'r'))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# queryclient.py
+# client of the query daemon (vanilla/query_server.py)
+# Usage:
+#   with QueryClient("data/query.sock") as qc:
+#       qc.path(src, dst)
+#       qc.resilience(client, guard)
+#       qc.trace_risk(trace="data/traces/trace0.txt")
+#       qc.batch([("path", {"src": a, "dst": b}), ("resilience", {...})])
+# Errors reported by the server raise QueryError.
+##################################################
+
+import json
+import socket
+
+
+class QueryError(Exception):
+    pass
+
+
+class QueryClient(object):
+    def __init__(self, path="data/query.sock", timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.fp = self.sock.makefile('rb')
+        self.next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.fp.close()
+        self.sock.close()
+
+    def request(self, op, args):
+        # raw response {"id", "result"} or {"id", "error"}
+        self.next_id += 1
+        line = json.dumps({"id": self.next_id, "op": op, "args": args}) + '\n'
+        self.sock.sendall(line.encode('utf-8'))
+        line = self.fp.readline()
+        if not line:
+            raise QueryError("connection closed by the server")
+        return json.loads(line)
+
+    def call(self, op, **args):
+        response = self.request(op, args)
+        if "error" in response:
+            raise QueryError(response["error"])
+        return response["result"]
+
+    def batch(self, requests):
+        # [(op, args), ...] in one round trip, results in order
+        response = self.call("batch", requests=[{"op": op, "args": args} for op, args in requests])
+        for r in response:
+            if "error" in r:
+                raise QueryError(r["error"])
+        return [r["result"] for r in response]
+
+    def ping(self):
+        return self.call("ping")
+
+    def info(self):
+        return self.call("info")
+
+    def path(self, src, dst):
+        return self.call("path", src=src, dst=dst)
+
+    def paths(self, src, dst):
+        return self.call("paths", src=src, dst=dst)
+
+    def on_path_ases(self, src, dst):
+        return set(self.call("on_path_ases", src=src, dst=dst))
+
+    def query(self, pairs, kind="path"):
+        return self.call("query", pairs=[list(p) for p in pairs], kind=kind)
+
+    def cg_path(self, client, guard):
+        return self.call("cg_path", client=client, guard=guard)
+
+    def resilience(self, client, guard=None):
+        return self.call("resilience", client=client, guard=guard)
+
+    def resilience_batch(self, pairs):
+        return self.call("resilience_batch", pairs=[list(p) for p in pairs])
+
+    def trace_risk(self, trace=None, locations=None, clients=None):
+        return self.call("trace_risk", trace=trace, locations=locations, clients=clients)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# resilstore.py
+# compact binary format for client to guard resiliences (cg_resilience.json)
+# Layout (little endian):
+# header: magic, version, n_clients, n_guards, n_names_bytes (padded to DATA_OFF)
+# matrix[n_clients][n_guards]       float32 resiliences, one row per client
+# names                             client ASNs then guard ASNs, newline separated
+# Writer(filename, clients, guards) sizes the matrix up front and writes each
+# row as its client finishes; the file is renamed into place on close().
+# Reader:
+# ResilStore(filename) mmaps the file; store.row(client) is a view of one row
+# and store[client] the {guard: resilience} dict of cg_resilience.json.
+# Export: python3 common/resilstore.py cg_resilience.bin [cg_resilience.json]
+##################################################
+
+import os
+import sys
+import json
+import mmap
+import struct
+import numpy as np
+
+
+MAGIC = b'CGRESIL1'
+VERSION = 1
+HEADER = struct.Struct('<8sIIIQ')
+DATA_OFF = 64
+
+
+def is_resilstore(filename):
+    with open(filename, 'rb') as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+class Writer(object):
+    def __init__(self, filename, clients, guards):
+        self.filename = filename
+        self.tmpfile = "%s.%d.tmp" % (filename, os.getpid())
+        self.n_guards = len(guards)
+        blob = '\n'.join(list(clients) + list(guards)).encode('utf-8')
+        self.fp = open(self.tmpfile, 'wb')
+        self.fp.write(HEADER.pack(MAGIC, VERSION, len(clients), len(guards), len(blob)))
+        # rows not written yet read as 0
+        self.fp.seek(DATA_OFF + len(clients) * len(guards) * 4)
+        self.fp.write(blob)
+        self.fp.flush()
+
+    def write_row(self, slot, row):
+        data = np.asarray(row, dtype='<f4').tobytes()
+        os.pwrite(self.fp.fileno(), data, DATA_OFF + slot * self.n_guards * 4)
+
+    def close(self):
+        self.fp.close()
+        os.replace(self.tmpfile, self.filename)
+
+
+def write(filename, client_dict):
+    # client_dict: {client: {guard: resilience}} as dumped to cg_resilience.json
+    clients = list(client_dict.keys())
+    guards = list(next(iter(client_dict.values())).keys()) if clients else []
+    writer = Writer(filename, clients, guards)
+    for slot, cl in enumerate(clients):
+        writer.write_row(slot, [client_dict[cl][g] for g in guards])
+    writer.close()
+
+
+class ResilStore(object):
+    def __init__(self, filename):
+        fp = open(filename, 'rb')
+        try:
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+        magic, version, n_clients, n_guards, n_blob = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a resilience store" % filename)
+        self.matrix = np.frombuffer(buf, dtype='<f4', count=n_clients * n_guards,
+                                    offset=DATA_OFF).reshape(n_clients, n_guards)
+        off = DATA_OFF + n_clients * n_guards * 4
+        names = buf[off:off+n_blob].decode('utf-8').split('\n') if n_blob else []
+        self.clients = names[:n_clients]
+        self.guards = names[n_clients:]
+        self.cindex = dict(zip(self.clients, range(n_clients)))
+        self.gindex = dict(zip(self.guards, range(n_guards)))
+
+    def __contains__(self, client):
+        return client in self.cindex
+
+    def __iter__(self):
+        return iter(self.clients)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __getitem__(self, client):
+        return dict(zip(self.guards, self.matrix[self.cindex[client]].tolist()))
+
+    def keys(self):
+        return list(self.clients)
+
+    def row(self, client):
+        return self.matrix[self.cindex[client]]
+
+
+def load(filename):
+    # a ResilStore for binary files, the parsed dict for cg_resilience.json
+    if is_resilstore(filename):
+        return ResilStore(filename)
+    return json.load(open(filename, 'r'))
+
+def export_json(store, filename):
+    with open(filename, 'w+') as fp:
+        json.dump(dict((cl, store[cl]) for cl in store), fp)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print("usage: %s cg_resilience.bin [cg_resilience.json]" % sys.argv[0])
+        sys.exit(1)
+    out = sys.argv[2] if len(sys.argv) == 3 else os.path.splitext(sys.argv[1])[0] + '.json'
+    export_json(ResilStore(sys.argv[1]), out)
+    print("%s written" % out)
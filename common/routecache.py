@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# routecache.py
+# on-disk cache of per-root route trees
+# Layout:
+# [cache_dir]/[topology hash]/[mode]/[root ASN].pkl
+# mode is the kind of tree stored (e.g. "best" or "tree" in predictpath).
+# The cache is capped in bytes; least recently used entries (by mtime,
+# refreshed on every hit) are evicted first.
+##################################################
+
+import os
+import pickle
+
+
+class RouteCache(object):
+    def __init__(self, cache_dir, digest, mode, max_bytes):
+        self.root = cache_dir
+        self.dir = os.path.join(cache_dir, digest[:16], mode)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.dir, exist_ok=True)
+
+    def path(self, asn):
+        return os.path.join(self.dir, "%s.pkl" % asn)
+
+    def __contains__(self, asn):
+        return os.path.exists(self.path(asn))
+
+    def get(self, asn):
+        filename = self.path(asn)
+        try:
+            with open(filename, 'rb') as fp:
+                tree = pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(filename, None) # mark as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return tree
+
+    def put(self, asn, tree):
+        filename = self.path(asn)
+        tmpfile = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmpfile, 'wb') as fp:
+            pickle.dump(tree, fp, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, filename)
+
+    def evict(self):
+        # drop least recently used entries, over all topologies and modes,
+        # until the cache fits in max_bytes
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for f in filenames:
+                if f.endswith('.pkl'):
+                    filename = os.path.join(dirpath, f)
+                    try:
+                        st = os.stat(filename)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, filename))
+        total = sum([e[1] for e in entries])
+        removed = 0
+        for mtime, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# topology.py
+# compiled CAIDA AS topology shared by the path and resilience scripts
+# Input:
+# CAIDA AS topology (as-rel2 format, "asn1|asn2|rel|source")
+# Output:
+# Binary CSR cache next to the topology file ([topology_file].[hash].csr),
+# loaded through mmap so that several processes share one copy
+##################################################
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+
+
+MAGIC = b'ASRELCSR'
+VERSION = 1
+# magic, version, number of ASes, edge counts of the three relationships
+HEADER = struct.Struct('<8sIIIII')
+
+# relationship lists, same layout as the old asdict[asn] entries
+# 0: provider-customer (customers of the AS)
+# 1: peer-to-peer (peers of the AS)
+# 2: customer-provider (providers of the AS)
+PC, PP, CP = 0, 1, 2
+
+
+class Adjacency(object):
+    # one relationship in CSR form: neighbors of node i are idx[ptr[i]:ptr[i+1]]
+    __slots__ = ('ptr', 'idx')
+
+    def __init__(self, ptr, idx):
+        self.ptr = ptr
+        self.idx = idx
+
+    def __getitem__(self, i):
+        return self.idx[self.ptr[i]:self.ptr[i+1]]
+
+    def __len__(self):
+        return len(self.ptr) - 1
+
+
+class Topology(object):
+    # ASes are numbered by ascending ASN, so comparing two indices gives the
+    # same answer as comparing the ASNs (used by the router ID tiebreak)
+    def __init__(self, asn, adj, digest, cachefile):
+        self.asn = asn              # index -> ASN (int)
+        self.adj = adj              # [customers, peers, providers]
+        self.digest = digest        # sha1 of the source topology file
+        self.cachefile = cachefile  # worker processes reopen (and share) this file
+        self.names = [str(a) for a in asn]
+        self.index = dict(zip(self.names, range(len(self.names))))
+
+    def __len__(self):
+        return len(self.asn)
+
+    def __contains__(self, asn):
+        return asn in self.index
+
+    def name(self, i):
+        return self.names[i]
+
+
+def file_digest(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def parse(filename):
+    # returns sorted ASN list and per relationship adjacency lists,
+    # keeping the order in which edges appear in the file
+    edges = []
+    for line in open(filename):
+        if not line.strip().startswith("#"):
+            arr = line.strip().split('|')
+            edges.append((int(arr[0]), int(arr[1]), int(arr[2]))) # -1: provider-customer; 0: peer-to-peer
+    asn = sorted(set([e[0] for e in edges]) | set([e[1] for e in edges]))
+    index = dict(zip(asn, range(len(asn))))
+    lists = [[[] for _ in asn] for _ in range(3)]
+    for asn1, asn2, rel in edges:
+        i = index[asn1]
+        j = index[asn2]
+        lists[rel+1][i].append(j)
+        lists[abs(rel)+1][j].append(i)
+    return asn, lists
+
+def compile_topology(filename, outfile):
+    asn, lists = parse(filename)
+    parts = [array('I', asn)]
+    counts = []
+    for lst in lists:
+        ptr = array('I', [0])
+        idx = array('I')
+        for nbrs in lst:
+            idx.extend(nbrs)
+            ptr.append(len(idx))
+        parts.append(ptr)
+        parts.append(idx)
+        counts.append(len(idx))
+    if sys.byteorder != 'little':
+        for p in parts:
+            p.byteswap()
+    # write to a temporary name first so concurrent readers never see a partial file
+    tmpfile = "%s.%d.tmp" % (outfile, os.getpid())
+    with open(tmpfile, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, len(asn), *counts))
+        for p in parts:
+            p.tofile(fp)
+    os.replace(tmpfile, outfile)
+
+def cache_path(filename, digest, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(filename))
+    return os.path.join(cache_dir, "%s.%s.csr" % (os.path.basename(filename), digest[:16]))
+
+def open_compiled(cachefile, digest=None):
+    fp = open(cachefile, 'rb')
+    try:
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fp.close()
+    magic, version, n, e0, e1, e2 = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        buf.close()
+        raise ValueError("%s is not a compiled topology" % cachefile)
+    view = memoryview(buf)
+    off = HEADER.size
+    arrays = []
+    for size in [n, n+1, e0, n+1, e1, n+1, e2]:
+        arrays.append(view[off:off+4*size].cast('I'))
+        off += 4 * size
+    if sys.byteorder != 'little':
+        arrays = [array('I', a) for a in arrays]
+        for a in arrays:
+            a.byteswap()
+    adj = [Adjacency(arrays[1], arrays[2]),
+           Adjacency(arrays[3], arrays[4]),
+           Adjacency(arrays[5], arrays[6])]
+    return Topology(arrays[0], adj, digest, cachefile)
+
+def attach(topo, cachefile, digest=None):
+    # topology of a worker process: topo itself if it is this cache already
+    # (sequential runs), otherwise the cache is mmapped, so the pages are
+    # shared with the other workers
+    if topo is None or topo.cachefile != cachefile:
+        topo = open_compiled(cachefile, digest)
+    return topo
+
+def load(filename, cache_dir=None):
+    # compile the topology on first use, then mmap the cached binary
+    digest = file_digest(filename)
+    cachefile = cache_path(filename, digest, cache_dir)
+    if not os.path.exists(cachefile):
+        # a read-only data directory keeps its cache under the same name in
+        # the temporary directory, where the next run finds it again
+        import tempfile
+        tmpcache = cache_path(filename, digest, tempfile.gettempdir())
+        if os.path.exists(tmpcache):
+            cachefile = tmpcache
+        else:
+            try:
+                compile_topology(filename, cachefile)
+            except OSError:
+                cachefile = tmpcache
+                compile_topology(filename, cachefile)
+    return open_compiled(cachefile, digest)
+
+def up_cone(topo, nodes):
+    # the given ASes (topology indices) and all their providers,
+    # transitively, in BFS order
+    seen = dict.fromkeys(nodes)
+    q = list(seen)
+    for current in q:
+        for node in topo.adj[CP][current]:
+            if node not in seen:
+                seen[node] = None
+                q.append(node)
+    return q
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# traces.py
+# mobility trace ingestion shared by the country scripts
+# Input:
+# Trace files, one location per line: "[code] YYYY-mm-dd HH:MM:SS"
+# Output:
+# Columnar cache next to the trace file ([trace_file].[hash].trc):
+# header: magic, version, n_codes, n_rows
+# ts[n_rows]     int64 seconds of the wall-clock time, sorted (stable)
+# code[n_rows]   uint32 ids into the codes
+# codes          distinct location codes, newline separated
+# Timestamps are compared as naive wall-clock times, so the order does not
+# depend on the local timezone (the old strptime/mktime parsing did, around
+# DST changes).
+##################################################
+
+import os
+import json
+import struct
+import numpy as np
+
+from topology import file_digest
+
+
+MAGIC = b'TRACECOL'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQ')
+
+
+class Trace(object):
+    def __init__(self, ts, code, codes):
+        self.ts = ts          # sorted timestamps
+        self.code = code      # location of each row, index into codes
+        self.codes = codes    # distinct location codes
+
+    def __len__(self):
+        return len(self.ts)
+
+    def locations(self):
+        # location codes in time order
+        return np.array(self.codes + [''])[self.code].tolist()
+
+
+def parse(filename):
+    codes = []
+    stamps = []
+    for line in open(filename, 'r'):
+        arr = line.split()
+        if arr:
+            codes.append(arr[0])
+            stamps.append(arr[1] + 'T' + arr[2])
+    if not codes:
+        return Trace(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint32), [])
+    ts = np.array(stamps, dtype='datetime64[s]').astype(np.int64)
+    order = np.argsort(ts, kind='stable')
+    names, code = np.unique(np.array(codes)[order], return_inverse=True)
+    return Trace(ts[order], code.astype(np.uint32), names.tolist())
+
+def write(trace, outfile):
+    blob = '\n'.join(trace.codes).encode('utf-8')
+    tmpfile = "%s.%d.tmp" % (outfile, os.getpid())
+    with open(tmpfile, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, len(trace.codes), len(trace)))
+        fp.write(trace.ts.astype('<i8').tobytes())
+        fp.write(trace.code.astype('<u4').tobytes())
+        fp.write(blob)
+    os.replace(tmpfile, outfile)
+
+def read(cachefile):
+    with open(cachefile, 'rb') as fp:
+        data = fp.read()
+    magic, version, n_codes, n = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("%s is not a trace cache" % cachefile)
+    off = HEADER.size
+    ts = np.frombuffer(data, dtype='<i8', count=n, offset=off).astype(np.int64)
+    off += 8 * n
+    code = np.frombuffer(data, dtype='<u4', count=n, offset=off).astype(np.uint32)
+    off += 4 * n
+    codes = data[off:].decode('utf-8').split('\n') if n_codes else []
+    return Trace(ts, code, codes)
+
+def cache_path(filename, digest, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(filename))
+    return os.path.join(cache_dir, "%s.%s.trc" % (os.path.basename(filename), digest[:16]))
+
+def load(filename, cache_dir=None):
+    # parse the trace on first use, then read the cached columns
+    cachefile = cache_path(filename, file_digest(filename), cache_dir)
+    try:
+        return read(cachefile)
+    except (OSError, ValueError, struct.error):
+        pass
+    trace = parse(filename)
+    try:
+        write(trace, cachefile)
+    except OSError:
+        pass # read-only trace directory: just parse again next time
+    return trace
+
+def load_cc_asn(filename):
+    return json.load(open(filename, 'r'))
+
+def locate(trace, cc_asn_d):
+    # ASNs of the trace locations in time order, and the codes (one per row)
+    # that have no AS in cc_asn_d
+    found = np.array([c in cc_asn_d for c in trace.codes] + [False])[trace.code]
+    asn = np.empty(len(trace.codes), dtype=object)
+    for i, c in enumerate(trace.codes):
+        asn[i] = cc_asn_d.get(c)
+    codes = np.array(trace.codes + [''])
+    return asn[trace.code[found]].tolist(), codes[trace.code[~found]].tolist()
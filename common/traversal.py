@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# traversal.py
+# valley-free (Gao-Rexford) route propagation over the compiled topology,
+# shared by predictpath and counter_raptor_resilience
+# Usage:
+#   graph = routes_to(topo, root, path_model("best", topo))   # predictpath
+#   graph = routes_from(topo, root, preference_model(topo))   # resilience
+# routes_to labels every AS with its own preferred routes towards the root
+# (customer routes up from the root, then peer routes, then provider routes,
+# shortest first). routes_from labels every AS with the way the root ranks
+# its route to it (uphill hops, then peer and downhill hops as weight).
+# Both schedules run walk() and hop() over the three relationships; a label
+# model is the label of the root and one relax function per relationship:
+# relax(graph, adj, frontier, new) labels or updates the neighbors of every
+# AS of frontier from its label, and appends the newly labeled ones to new.
+# graph[node] is the label of every AS reached, nodes are topology indices.
+##################################################
+
+import topology
+
+
+# every AS of frontier, then every AS newly labeled, in BFS order, relaxes
+# its neighbors in adj (the list relax iterates over is the one it appends to)
+def walk(graph, adj, frontier, relax):
+    q = list(frontier)
+    relax(graph, adj, q, q)
+
+# every AS of frontier relaxes its neighbors in adj once; returns the newly
+# labeled ASes in order
+def hop(graph, adj, frontier, relax):
+    new = []
+    relax(graph, adj, frontier, new)
+    return new
+
+# routes towards root: the customer-provider BFS from the root, one peer hop
+# from the ASes it reached, then the provider-customer walk from all of them.
+# check(graph, phase) runs after every phase if given.
+def routes_to(topo, root, model, check=None):
+    init, up, across, down = model
+    graph = {root: init(root)}
+    walk(graph, topo.adj[topology.CP], [root], up)
+    if check:
+        check(graph, "customer-provider")
+    hop(graph, topo.adj[topology.PP], list(graph.keys()), across)
+    if check:
+        check(graph, "peer-peer")
+    walk(graph, topo.adj[topology.PC], list(graph.keys()), down)
+    if check:
+        check(graph, "provider-customer")
+    return graph
+
+# routes of root: for every uphill level (the root first, then its
+# providers, their providers...), the downhill walk from the level and the
+# downhill walk from its new peers, before climbing to the next level
+def routes_from(topo, root, model):
+    init, up, across, down = model
+    graph = {root: init(root)}
+    level = [root]
+    while level:
+        walk(graph, topo.adj[topology.PC], level, down)
+        walk(graph, topo.adj[topology.PC], hop(graph, topo.adj[topology.PP], level, across), down)
+        level = hop(graph, topo.adj[topology.CP], level, up)
+    return graph
+
+
+# label models of routes_to, one per predictpath engine. The label type is
+# 0 (customer route), 1 (peer) or 2 (provider); a route of the same type and
+# length adds its paths, a shorter peer or provider route replaces the label.
+# The label of an AS is read when it is dequeued.
+#
+# paths: graph[node] = [type, path1, path2, ...], every equal-length path
+# tree: graph[node] = [type, length, npaths, node, [(pred_route, npaths_of_pred), ...]]
+#   paths of a route are [node] + each of the first npaths_of_pred paths of
+#   every predecessor, in the order they were added, which is exactly the
+#   list of the paths model. A replaced label is a new route object, so
+#   routes that still point to the old one keep their paths.
+# best: graph[node] = [type, length, (node, (next_hop, (... (root, None))))]
+#   only the lowest-ASN path, as linked cells sharing their tails. Comparing
+#   two cells of the same length compares the paths ASN by ASN (topology
+#   indices follow ASN order), so the result equals the lowest path of the
+#   paths model.
+def path_model(engine, topo):
+    def problem(current, node):
+        print("we have problem for cur node %s and its cp node %s" % (topo.name(current),topo.name(node)))
+
+    if engine == "best":
+        def init(root):
+            return [0,1,(root,None)]
+
+        def relax(kind):
+            def scan(graph, adj, frontier, new):
+                for current in frontier:
+                    cur_len = graph[current][1]
+                    cur_best = graph[current][2]
+                    for node in adj[current]:
+                        if node in graph:
+                            route = graph[node]
+                            if route[0] != kind:
+                                pass
+                            elif route[1] == (cur_len + 1):
+                                if cur_best < route[2][1]:
+                                    route[2] = (node,cur_best)
+                            elif route[1] > (cur_len + 1):
+                                if kind == 0:
+                                    problem(current, node)
+                                else:
+                                    graph[node] = [kind,cur_len+1,(node,cur_best)]
+                        else:
+                            graph[node] = [kind,cur_len+1,(node,cur_best)]
+                            new.append(node)
+            return scan
+    elif engine == "tree":
+        def init(root):
+            return [0,1,1,root,[]]
+
+        def relax(kind):
+            def scan(graph, adj, frontier, new):
+                for current in frontier:
+                    cur = graph[current]
+                    cur_len = cur[1]
+                    cur_n = cur[2]
+                    for node in adj[current]:
+                        if node in graph:
+                            route = graph[node]
+                            if route[0] != kind:
+                                pass
+                            elif route[1] == (cur_len + 1):
+                                route[4].append((cur,cur_n))
+                                route[2] += cur_n
+                            elif route[1] > (cur_len + 1):
+                                if kind == 0:
+                                    problem(current, node)
+                                else:
+                                    graph[node] = [kind,cur_len+1,cur_n,node,[(cur,cur_n)]]
+                        else:
+                            graph[node] = [kind,cur_len+1,cur_n,node,[(cur,cur_n)]]
+                            new.append(node)
+            return scan
+    else:
+        def init(root):
+            return [0,[root]]
+
+        def relax(kind):
+            def scan(graph, adj, frontier, new):
+                for current in frontier:
+                    cur_len = len(graph[current][1])
+                    cur_path = graph[current][1:]
+                    for node in adj[current]:
+                        if node in graph:
+                            route = graph[node]
+                            if route[0] != kind:
+                                continue
+                            path_len = len(route[1])
+                            if path_len > (cur_len + 1):
+                                if kind == 0:
+                                    problem(current, node)
+                                    continue
+                                route = graph[node] = [kind]
+                            elif path_len != (cur_len + 1):
+                                continue
+                        else:
+                            route = graph[node] = [kind]
+                            new.append(node)
+                        for each in cur_path:
+                            route.append([node] + each)
+            return scan
+    return init, relax(0), relax(1), relax(2)
+
+# lazily enumerate the first limit paths of a tree route (all of them by default)
+def iter_paths(route, limit=None):
+    if limit is None:
+        limit = route[2]
+    if not route[4]:
+        yield [route[3]]
+        return
+    for pred, cnt in route[4]:
+        for each in iter_paths(pred, min(cnt, limit)):
+            yield [route[3]] + each
+        limit -= cnt
+        if limit <= 0:
+            break
+
+# path of a best cell, from the node to the root
+def cell_path(cell):
+    path = []
+    while cell is not None:
+        path.append(cell[0])
+        cell = cell[1]
+    return path
+
+
+# label model of routes_from (Counter-RAPTOR resilience):
+# graph[node] = [weight, equal_paths, uphill_hops], weight = peer hops *
+# total_as + downhill hops. A node is labeled once; a route with the same
+# weight (downhill and peer hops) or the same uphill hops (climbing) adds its
+# equal paths.
+def preference_model(topo):
+    total_as = len(topo)
+
+    def init(root):
+        return [0,1,0]
+
+    # customer to provider
+    def up(graph, adj, frontier, new):
+        for current in frontier:
+            val = graph[current]
+            for node in adj[current]:
+                if node not in graph:
+                    graph[node] = [val[0], val[1], val[2] + 1]
+                    new.append(node)
+                elif graph[node][2] == (val[2]+1):
+                    graph[node][1] += val[1]
+
+    # peer to peer
+    def across(graph, adj, frontier, new):
+        for current in frontier:
+            val = graph[current]
+            for node in adj[current]:
+                if node not in graph:
+                    graph[node] = [val[0] + total_as, val[1], val[2]]
+                    new.append(node)
+                elif graph[node][0] == val[0] + total_as:
+                    graph[node][1] += val[1]
+
+    # provider to customer
+    def down(graph, adj, frontier, new):
+        for current in frontier:
+            val = graph[current]
+            for node in adj[current]:
+                if node not in graph:
+                    graph[node] = [val[0] + 1, val[1], val[2]]
+                    new.append(node)
+                elif graph[node][0] == val[0] + 1:
+                    graph[node][1] += val[1]
+
+    return init, up, across, down
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# workers.py
+# process pool of the scripts that compute independent roots, clients or traces
+# Usage:
+#   init_worker(*worker_args)  # state of the sequential run, in this process
+#   for res in workers.imap(solve, tasks, args.workers, init_worker, worker_args):
+# With more than one worker, every pool process runs init_worker(*worker_args)
+# once and results are yielded as tasks complete; otherwise the tasks run
+# here in order.
+##################################################
+
+
+def imap(func, tasks, num_workers, initializer=None, initargs=(), chunksize=1):
+    if num_workers > 1:
+        from multiprocessing import Pool
+        pool = Pool(num_workers, initializer, initargs)
+        try:
+            for res in pool.imap_unordered(func, tasks, chunksize):
+                yield res
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            yield func(task)
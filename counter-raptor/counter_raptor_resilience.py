@@ -8,115 +8,128 @@
 # List of Tor guard ASes (--guard_as_file, default="../data/as_guard.txt")
 # CAIDA AS topology (--topology_file, default="../data/20161001.as-rel2.txt")
 # Output:
-# Tor client to guard resiliences (cg_resilience.json)
+# Tor client to guard resiliences (cg_resilience.json, or the float32 matrix
+# cg_resilience.bin with --output_format binary, see common/resilstore.py,
+# written row by row as clients finish)
+# With --shard i/N only every N-th client starting at i is computed and
+# written to cg_resilience.i-of-N.json (.bin); --merge N joins the N shard
+# files into cg_resilience.json (.bin).
+# With --adversary_file (top ASes, the first --num_adversaries are used) the
+# same BFS also gives the hijackers of every (client, guard): the adversaries
+# whose route from the client is preferred over the route to the guard.
+# Written to cg_hijack_as.json ({client: {guard: [ASes]}}), or with
+# --output_format binary to cg_hijack_as.npz (clients, guards, adversaries,
+# bits[client][guard]: adversary bits packed little endian into bytes).
+# With --journal [file] the row (and hijackers) of every client is appended to
+# the journal as the client completes and the outputs are written from the
+# journal at the end, one client at a time; --resume continues an interrupted run, skipping the
+# clients already in the journal (see common/journal.py).
+# --stats [file] appends run statistics as JSON lines, see common/instrument.py
 ##################################################
 
 
+import os
 import sys
 import json
 import time
-from collections import deque
+import zipfile
 import argparse
-from copy import deepcopy
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+import topology
+import instrument
+import workers
+import resilstore
+import traversal
+from journal import Journal
 
 
 # graph format: graph[node] = [weight, equal_paths, uphill_hops]
-# initialize graph
-def init(root):
-    global graph
-    graph = {}
-    graph[root] = [0,1,0]
-
-# provider to customer
-def bfs_pc(q_lst):
-    global graph, asdict
-    q = deque(q_lst)
-    while q:
-        current = q.popleft()
-        val = graph[current]
-        for node in asdict[current][0]:
-            if node not in graph:
-                graph[node] = [val[0] + 1, val[1], val[2]]
-                q.append(node)
-            elif graph[node][0] == val[0] + 1:
-                graph[node][1] += val[1]
-
-# peer to peer
-def bfs_pp(q_lst):
-    global graph, asdict, total_as
-    q = deque()
-    for rt in q_lst:
-        for node in asdict[rt][1]:
-            if node not in graph:
-                graph[node] = [graph[rt][0] + total_as, graph[rt][1], graph[rt][2]]
-                q.append(node)
-            elif graph[node][0] == graph[rt][0] + total_as:
-                graph[node][1] += graph[rt][1]
-    while q:
-        current = q.popleft()
-        val = graph[current]
-        for node in asdict[current][0]:
-            if node not in graph:
-                graph[node] = [val[0] + 1, val[1], val[2]]
-                q.append(node)
-            elif graph[node][0] == val[0] + 1:
-                graph[node][1] += val[1]
-
-# customer to provider
-def bfs_cp(root):
-    global graph, asdict
-    q = deque([root])
-    curlst = []
-    curlevel = 0
-    while q:
-        current = q.popleft()
-        val = graph[current]
-        if val[2] > curlevel:
-            bfs_pc(curlst)
-            bfs_pp(curlst)
-            curlst = []
-            curlevel = val[2]
-        for node in asdict[current][2]:
-            if node not in graph:
-                graph[node] = [val[0], val[1], val[2] + 1]
-                q.append(node)
-                curlst.append(node)
-            elif graph[node][2] == (val[2]+1):
-                graph[node][1] += val[1]
+# nodes are topology indices; the routes of a client are computed by
+# traversal.routes_from, see traversal.preference_model
+
+# rank the nodes of the last BFS by (uphill_hops, weight), lower is preferred
+# by the client. weight is peers * total_as + downhill hops, so the rank is
+# a bucket over (uphill, peers, downhill).
+# returns nodes, buckets and equal paths
+def rank_nodes():
+    global graph, total_as
+    n = len(graph)
+    nodes = np.fromiter(graph.keys(), dtype=np.int64, count=n)
+    vals = np.array(list(graph.values()), dtype=np.float64).reshape(n, 3)
+    weight = vals[:,0].astype(np.int64)
+    eq = vals[:,1]
+    uphill = vals[:,2].astype(np.int64)
+    if n == 0:
+        return nodes, weight, eq
+    peer = weight // total_as
+    down = weight % total_as
+    bucket = (uphill * (peer.max() + 1) + peer) * (down.max() + 1) + down
+    return nodes, bucket, eq
 
 # traverse nodes to calculate resiliency
-def update_resilience():
-    global graph, tordict, total_as
-    L = sorted(list(graph.items()), key=lambda k_v: (-k_v[1][2],-k_v[1][0]))
-    L2 = [k_v1[0] for k_v1 in L]
-    #print L2
-    unreachable = total_as - 1 - len(L2)
-    #print "number of unreachable nodes is %i" % unreachable
-    nodes = 0
-    prev = ()
-    eq_path = 0
-    eq_nodes = 0
-    buffer = []
-    for item in L2:
-        val = graph[item]
-        if prev==(val[0],val[2]):
-            eq_path += val[1]
-            eq_nodes += 1
-            if item in tordict:
-                buffer.append((item,val[1]))
-        else:
-            for node in buffer:
-                tordict[node[0]] += nodes + unreachable + ((node[1] / eq_path) if eq_nodes > 1 else 0)
-            buffer = []
-            nodes += eq_nodes
-            eq_path = val[1]
-            eq_nodes = 1
-            prev = (val[0],val[2])
-            if item in tordict:
-                buffer = [(item,val[1])]
-    # leftover nodes in buffer
-    for node in buffer:
-        tordict[node[0]] += nodes + unreachable + ((node[1] / eq_path) if eq_nodes > 1 else 0)
+# Nodes are ranked by decreasing bucket. Equal buckets form one group; a
+# guard scores the number of nodes in earlier groups plus the unreachable
+# nodes, plus its share of the group's equal paths when the group has more
+# than one node, so the ranking is a counting sort over the buckets.
+# Scores of all reachable guards are written to row at once.
+def update_resilience(row, ranked):
+    global tor_nodes, tor_cols, pos, total_as
+    nodes, bucket, eq = ranked
+    n = len(nodes)
+    if n == 0:
+        return
+    unreachable = total_as - 1 - n
+    count = np.bincount(bucket)
+    eq_path = np.bincount(bucket, weights=eq)
+    # nodes ranked before each bucket are the ones in higher buckets
+    before = np.cumsum(count[::-1])[::-1] - count
+    # reachable guards
+    pos[nodes] = np.arange(n)
+    p = pos[tor_nodes]
+    hit = p >= 0
+    p = p[hit]
+    b = bucket[p]
+    share = np.where(count[b] > 1, eq[p] / eq_path[b], 0.0)
+    row[tor_cols[hit]] = (before[b] + unreachable + share) / (total_as - 2)
+    pos[nodes] = -1
+
+# hijackers of every guard, from the same ranking: an adversary wins when the
+# client prefers its route over the route to the guard (on equal buckets when
+# hijack_ties is "hijacker"). Unreached adversaries never win, every reached
+# one wins against an unreached guard, and a guard does not hijack itself.
+# returns the adversary bits of each guard, packed (guards, bytes)
+def update_hijackers(ranked):
+    global tor_nodes, tor_cols, pos, adv_nodes, num_guards, hijack_ties
+    nodes, bucket, _ = ranked
+    top = int(bucket.max()) if len(nodes) else 0
+    pos[nodes] = np.arange(len(nodes))
+    p = np.where(adv_nodes >= 0, pos[adv_nodes], -1)
+    ba = np.where(p >= 0, bucket[np.maximum(p, 0)], top + 2)
+    bg = np.full(num_guards, top + 1, dtype=np.int64)
+    p = pos[tor_nodes]
+    bg[tor_cols[p >= 0]] = bucket[p[p >= 0]]
+    pos[nodes] = -1
+    win = ba[None, :] < bg[:, None]
+    if hijack_ties == "hijacker":
+        win |= ba[None, :] == bg[:, None]
+    guard_nodes = np.full(num_guards, -2, dtype=np.int64)
+    guard_nodes[tor_cols] = tor_nodes
+    win &= adv_nodes[None, :] != guard_nodes[:, None]
+    return np.packbits(win, axis=-1, bitorder='little')
+
+# work of the last BFS for --stats: nodes reached and adjacency entries
+# scanned. Nodes reached uphill (weight 0, the root included) scan their
+# providers, peers and customers, all other nodes only their customers.
+def root_stats():
+    adj = topo.adj
+    edges = 0
+    for n, val in graph.items():
+        edges += len(adj[topology.PC][n])
+        if val[0] == 0:
+            edges += len(adj[topology.CP][n]) + len(adj[topology.PP][n])
+    return {"nodes": len(graph), "edges": edges}
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -126,67 +139,267 @@ def parse_args():
                         default="../data/top400client.txt")
     parser.add_argument("--guard_as_file",
                         default="../data/as_guard.txt")
-    return parser.parse_args()
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes computing clients in parallel")
+    parser.add_argument("--shard", default=None,
+                        help="i/N: compute the i-th of N client shards")
+    parser.add_argument("--merge", type=int, default=None,
+                        help="merge the given number of shard files")
+    parser.add_argument("--output_format", choices=["json", "binary"],
+                        default="json")
+    parser.add_argument("--adversary_file", default=None,
+                        help="adversary ASes, one per line (e.g. ../data/top50ases.txt)")
+    parser.add_argument("--num_adversaries", type=int, default=50,
+                        help="number of adversaries taken from the top of --adversary_file")
+    parser.add_argument("--hijack_ties", choices=["hijacker", "guard"], default="hijacker",
+                        help="winner when the client ranks both routes the same")
+    parser.add_argument("--journal", default=None,
+                        help="append the result of every client to this file (e.g. ../data/cg_resilience.journal)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the clients already in --journal")
+    parser.add_argument("--stats", default=None,
+                        help="append per phase and per client statistics (JSON lines) to this file")
+    args = parser.parse_args()
+    if args.resume and not args.journal:
+        parser.error("--resume needs --journal")
+    if args.journal and args.merge:
+        parser.error("--merge does not compute clients, it cannot be used with --journal")
+    if args.adversary_file and (args.shard or args.merge):
+        parser.error("--adversary_file needs a full run, without --shard or --merge")
+    if args.shard:
+        try:
+            args.shard = tuple(int(x) for x in args.shard.split('/'))
+        except ValueError:
+            args.shard = ()
+        if len(args.shard) != 2 or not 0 <= args.shard[0] < args.shard[1]:
+            parser.error("--shard must be i/N with 0 <= i < N")
+    return args
+
+def output_file(fmt):
+    return '../data/cg_resilience.%s' % ('bin' if fmt == "binary" else 'json')
+
+def shard_file(i, n, fmt="json"):
+    return '../data/cg_resilience.%d-of-%d.%s' % (i, n, 'bin' if fmt == "binary" else 'json')
+
+def write_output(outfile, client_dict):
+    if outfile.endswith('.bin'):
+        resilstore.write(outfile, client_dict)
+    else:
+        with open(outfile, 'w+') as fp:
+            json.dump(client_dict, fp)
+
+def write_journal(outfile, journal, client_lst, guard_lst):
+    # rows are read back one client at a time, in client file order
+    if outfile.endswith('.bin'):
+        writer = resilstore.Writer(outfile, client_lst, guard_lst)
+        for slot, item in enumerate(client_lst):
+            writer.write_row(slot, journal.get(item)[0])
+        writer.close()
+    else:
+        # same bytes as json.dump of the client dict
+        with open(outfile, 'w+') as fp:
+            fp.write('{')
+            for slot, item in enumerate(client_lst):
+                row = journal.get(item)[0]
+                fp.write('%s%s: %s' % (', ' if slot else '', json.dumps(item),
+                                       json.dumps(dict(zip(guard_lst, row.tolist())))))
+            fp.write('}')
+
+def write_hijackers(outfile, client_lst, guard_lst, adv_lst, rows):
+    # rows: the packed bits of each client in client file order, written one
+    # client at a time (the bits array of np.savez_compressed is streamed
+    # into the archive), so a journal run never holds all of them
+    num_bytes = (len(adv_lst) + 7) // 8
+    if outfile.endswith('.npz'):
+        with zipfile.ZipFile(outfile, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            for name, value in (("clients", client_lst), ("guards", guard_lst), ("adversaries", adv_lst)):
+                with zf.open(name + '.npy', 'w', force_zip64=True) as fp:
+                    np.lib.format.write_array(fp, np.asarray(value), allow_pickle=False)
+            with zf.open('bits.npy', 'w', force_zip64=True) as fp:
+                np.lib.format.write_array_header_1_0(fp, {"descr": np.lib.format.dtype_to_descr(np.dtype(np.uint8)),
+                                                          "fortran_order": False,
+                                                          "shape": (len(client_lst), len(guard_lst), num_bytes)})
+                for bits in rows:
+                    fp.write(np.ascontiguousarray(bits, dtype=np.uint8).tobytes())
+        return
+    adv = np.array(adv_lst, dtype=object)
+    # same bytes as json.dump of {client: {guard: [ASes]}}
+    with open(outfile, 'w+') as fp:
+        fp.write('{')
+        for slot, (item, bits) in enumerate(zip(client_lst, rows)):
+            win = np.unpackbits(bits, axis=-1, count=len(adv_lst), bitorder='little').astype(bool)
+            fp.write('%s%s: %s' % (', ' if slot else '', json.dumps(item),
+                                   json.dumps(dict(zip(guard_lst, [adv[w].tolist() for w in win])))))
+        fp.write('}')
+
+# per-process state for solve_client; set in the parent when running sequentially
+def init_worker(cachefile, digest, guard_lst, measure=False, adv_lst=None, ties="hijacker"):
+    global topo, tor_nodes, tor_cols, pos, total_as, num_guards, measure_work, adv_nodes, hijack_ties, model
+    topo = topology.attach(topo, cachefile, digest)
+    total_as = len(topo)
+    model = traversal.preference_model(topo)
+    num_guards = len(guard_lst)
+    # columns and topology indices of the guards present in the topology
+    tor_cols = np.array([i for i, g in enumerate(guard_lst) if g in topo], dtype=np.int64)
+    tor_nodes = np.array([topo.index[guard_lst[i]] for i in tor_cols], dtype=np.int64)
+    pos = np.full(total_as, -1, dtype=np.int64)
+    measure_work = measure
+    # topology indices of the adversaries, -1 if not in the topology
+    adv_nodes = None
+    if adv_lst is not None:
+        adv_nodes = np.array([topo.index.get(a, -1) for a in adv_lst], dtype=np.int64)
+    hijack_ties = ties
+
+# resilience row of one client (and its work with --stats, None otherwise,
+# and its hijacker bits with adversaries, None otherwise)
+def solve_client(task):
+    global graph
+    slot, item = task
+    if measure_work:
+        start = instrument.clock()
+    row = np.zeros(num_guards, dtype=np.float64)
+    root = topo.index[item]
+    graph = traversal.routes_from(topo, root, model)
+    work = root_stats() if measure_work else None
+    graph.pop(root,None)
+    ranked = rank_nodes()
+    update_resilience(row, ranked)
+    hij = update_hijackers(ranked) if adv_nodes is not None else None
+    if measure_work:
+        work.update(instrument.elapsed(start))
+    return slot, item, row, work, hij
+
+def run_clients(tasks, args):
+    # yields (slot, client, row, work, hijackers) as clients complete
+    return workers.imap(solve_client, tasks, args.workers, init_worker, worker_args)
+
+topo = None
 
 def main(args):
-    global asdict, tordict, graph, total_as
-    asdict = {}
+    global topo, worker_args
+    stats = instrument.Stats(args.stats, "resilience")
+    stats.begin("load")
     tordict = {}
 
-    # load AS relationships from CAIDA topo file
-    # asdict[asn] = [[provider-customer edges],[peer-to-peer edges],[customer-provider edges]]
-    for line in open(args.topology_file):
-        if not line.strip().startswith("#"):
-            arr = line.strip().split('|')
-            asn1 = arr[0]
-            asn2 = arr[1]
-            rel = int(arr[2]) # -1: provider-customer; 0: peer-to-peer
-            if asn1 in asdict:
-                asdict[asn1][rel+1].append(asn2)
-            else:
-                asdict[asn1] = [[],[],[]]
-                asdict[asn1][rel+1] = [asn2]
-            if asn2 in asdict:
-                asdict[asn2][abs(rel)+1].append(asn1)
-            else:
-                asdict[asn2] = [[],[],[]]
-                asdict[asn2][abs(rel)+1] = [asn1]
+    # load AS relationships from the compiled CAIDA topology
+    # topo.adj[k][asn] = [provider-customer, peer-to-peer, customer-provider][k] edges
+    topo = topology.load(args.topology_file)
 
     for line in open(args.guard_as_file):
         tordict[line.strip()] = 0
-
-    total_as = len(asdict)
+    guard_lst = list(tordict.keys())
+    adv_lst = None
+    if args.adversary_file:
+        adv_lst = list(dict.fromkeys([line.strip() for line in open(args.adversary_file)
+                                      if line.strip()]))[:args.num_adversaries]
+    worker_args = (topo.cachefile, topo.digest, guard_lst, bool(stats), adv_lst, args.hijack_ties)
+    init_worker(*worker_args)
     print("%d ASes found in topology and %d Tor ASes" % (total_as, len(tordict)))
 
-    # start caculation per client
-    client_dict = {}
-    start = time.time()
-
+    client_lst = []
     for line in open(args.client_file):
         item = line.strip()
-        if not item in asdict:
+        if not item in topo:
             print("sorry we cannot find the client asn %s" % item)
         else:
-            init(item)
-            bfs_pc([item])
-            bfs_pp([item])
-            bfs_cp(item)
-            graph.pop(item,None)
-            update_resilience()
-            for el in tordict:
-                tordict[el] = tordict[el] / (total_as - 2)
-            if sum(tordict.values()) == 0:
-                print("%s client have all 0 values" % item)
-            client_dict[item] = deepcopy(tordict)
-            tordict = dict.fromkeys(tordict, 0)
+            client_lst.append(item)
+    client_lst = list(dict.fromkeys(client_lst))
+
+    if args.merge:
+        # shards are joined back in client file order
+        owner = {} # shard of each client
+        for i in range(args.merge):
+            shard = resilstore.load(shard_file(i, args.merge, args.output_format))
+            for c in shard:
+                owner[c] = shard
+        missing = [c for c in client_lst if c not in owner]
+        if missing:
+            print("%d clients missing from the shards, e.g. %s" % (len(missing), missing[0]))
+            sys.exit(1)
+        outfile = output_file(args.output_format)
+        if args.output_format == "binary":
+            # rows are copied from the shard matrices one at a time
+            for shard in set(owner.values()):
+                if shard.guards != guard_lst:
+                    print("shard guards differ from %s" % args.guard_as_file)
+                    sys.exit(1)
+            writer = resilstore.Writer(outfile, client_lst, guard_lst)
+            for slot, c in enumerate(client_lst):
+                writer.write_row(slot, owner[c].row(c))
+            writer.close()
+        else:
+            write_output(outfile, dict((c, owner[c][c]) for c in client_lst))
+        stats.close()
+        return
+
+    if args.shard:
+        client_lst = client_lst[args.shard[0]::args.shard[1]]
+
+    outfile = shard_file(args.shard[0], args.shard[1], args.output_format) if args.shard \
+        else output_file(args.output_format)
+
+    # start caculation per client
+    # rows go to the journal, straight to the binary matrix, or are kept for
+    # the JSON dump
+    # resil[i][j]: resilience of client_lst[i] to guard_lst[j]
+    journal = None
+    if args.journal:
+        journal = Journal(args.journal, {"script": "counter_raptor_resilience", "topology": topo.digest,
+                                         "clients": client_lst, "guards": guard_lst,
+                                         "adversaries": adv_lst, "ties": args.hijack_ties},
+                          args.resume)
+        if args.resume:
+            print("%d clients found in %s" % (len(journal), args.journal))
+    elif args.output_format == "binary":
+        writer = resilstore.Writer(outfile, client_lst, guard_lst)
+        store_row = writer.write_row
+    else:
+        resil = np.zeros((len(client_lst), len(guard_lst)), dtype=np.float64)
+        def store_row(slot, row):
+            resil[slot] = row
+    tasks = [(slot, item) for slot, item in enumerate(client_lst)
+             if journal is None or item not in journal]
+    if adv_lst is not None and journal is None:
+        hijackers = np.zeros((len(client_lst), len(guard_lst), (len(adv_lst) + 7) // 8), dtype=np.uint8)
+
+    stats.begin("resilience")
+    start = time.time()
+
+    for slot, item, row, work, hij in run_clients(tasks, args):
+        stats.root(item, work)
+        if journal is not None:
+            journal.append(item, (row, hij))
+        else:
+            store_row(slot, row)
+            if hij is not None:
+                hijackers[slot] = hij
+        if not row.any():
+            print("%s client have all 0 values" % item)
 
     end = time.time()
     print(end - start)
 
-    with open('../data/cg_resilience.json', 'w+') as fp:
-        json.dump(client_dict, fp)
+    stats.begin("dump")
+    if journal is not None:
+        # the results of this run and of the interrupted ones
+        write_journal(outfile, journal, client_lst, guard_lst)
+        if adv_lst is not None:
+            hijackers = (journal.get(item)[1] for item in client_lst)
+    elif args.output_format == "binary":
+        writer.close()
+    else:
+        client_dict = {}
+        for i, item in enumerate(client_lst):
+            client_dict[item] = dict(zip(guard_lst, resil[i].tolist()))
+        write_output(outfile, client_dict)
+    if adv_lst is not None:
+        write_hijackers('../data/cg_hijack_as.%s' % ('npz' if args.output_format == "binary" else 'json'),
+                        client_lst, guard_lst, adv_lst, hijackers)
+    if journal is not None:
+        journal.close()
+    stats.add(clients=len(client_lst))
+    stats.close()
 
 
 if __name__ == '__main__':
     main(parse_args())
-
@@ -6,146 +6,204 @@
 # Input:
 # List of Tor client ASes (--client_file, default="./all_ases.txt")
 # Tor guard relay bandwidth (--guard_file, default="../data/guard_as_bw.json")
-# Tor client to guard resiliences (--resil_file, default="../data/cg_resilience.json")
+# Tor client to guard resiliences (--resil_file, default="../data/cg_resilience.json",
+#   or the cg_resilience.bin matrix, of which only the rows of the trace are read)
+# Hijacking ASes (--hijack_file, cg_hijack_as.json or the cg_hijack_as.npz
+#   bitset, both written by counter_raptor_resilience.py --adversary_file)
 # Output:
 # Resilience probabilities for each client AS of each alpha value (al[alpha]_cl[clientAS].txt)
+# With --sweep_alpha/--sweep_sample_size the whole grid is computed from one
+# load of the inputs and saved to dat_files/[n]_[client_file].sweep.npz
+# (alpha, sample_size, sample_count, clients, risk[alpha][sample_size][client]).
+# --simulate [users] draws guards and hijackers for that many simulated users
+# (common/guardsim.py, --seed, --chunk) and saves their time to first
+# compromise to dat_files/[n]_[client_file].sim.npz
+# (first_compromise[location], never compromised last; guard, picks[guard]).
+# --stats [file] appends run statistics as JSON lines, see common/instrument.py
 ##################################################
 
 
+import os
 import sys
 import json
 import math
 import argparse
-import datetime
-import time
 from os.path import basename
-from copy import deepcopy
+import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+import traces
+import instrument
+import guardsim
+import resilstore
+from bitsets import popcount
 
-def helper_calc(lst,k):
-    s = sum(lst)
-    for i in range(0,len(lst)):
-        lst[i] = (lst[i]*k)/s
-    return lst
+
+# Capped sampling probabilities (water-filling): scale each row to sum k,
+# cap entries at 1 and rescale the rest to the remaining mass, until no entry
+# exceeds 1. Entries are capped from the largest down, so with the row sorted
+# in decreasing order the capped set is the shortest prefix m such that
+# x[m] * (k - m) / sum(x[m:]) <= 1. Zero entries are never capped.
+# Returns probabilities divided by k.
+# resil: (guards,) or (clients, guards); sizes: scalar or (sizes,)
+# result: sizes.shape + resil.shape
+def capped_prob(resil, sizes):
+    resil = np.asarray(resil, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    x = np.atleast_2d(resil)
+    order = np.argsort(-x, axis=-1, kind='stable')
+    xs = np.take_along_axis(x, order, axis=-1)
+    # rest[..., m]: sum of the entries after the m largest
+    rest = np.cumsum(xs[..., ::-1], axis=-1)[..., ::-1]
+    m = np.arange(x.shape[-1])
+    k = sizes.reshape(-1, 1, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fits = (rest[None] == 0) | (xs[None] * (k - m) <= rest[None])
+    # number of capped entries (all of them if no prefix fits)
+    ncap = np.where(fits.any(axis=-1), fits.argmax(axis=-1), x.shape[-1])
+    rest_cap = np.take_along_axis(np.broadcast_to(rest, fits.shape),
+                                  np.minimum(ncap, x.shape[-1] - 1)[..., None], axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(rest_cap > 0, (k - ncap[..., None]) / rest_cap, 0.0)
+    ps = np.where((m < ncap[..., None]) & (xs[None] > 0), 1.0, xs[None] * scale) / k
+    out = np.empty_like(ps)
+    np.put_along_axis(out, np.broadcast_to(order, ps.shape), ps, axis=-1)
+    return out.reshape(sizes.shape + resil.shape)
 
 def recalcprob(lst,k):
-    tmplst = helper_calc(lst,k)
-    finallst = [0] * len(tmplst)
-    counter = 0
-    while max(tmplst) > 1:
-        for i in range(0,len(tmplst)):
-            if tmplst[i] > 1:
-                finallst[i] = 1
-                tmplst[i] = 0
-                counter += 1
-        if max(tmplst) > 0:
-            tmplst = helper_calc(tmplst,k-counter)
-        else:
-            break
-    for i in range(0,len(tmplst)):
-        if tmplst[i] != 0:
-            finallst[i] = tmplst[i]
-    return [i/k for i in finallst]
-
-def orderClient(filename):
-    clientlst = []
-    for line in open(filename, 'r'):
-        asnum = line.split()[0]
-        tsstr = ' '.join(line.strip().split()[1:])
-        ts = int(time.mktime(datetime.datetime.strptime(tsstr, "%Y-%m-%d %H:%M:%S").timetuple()))
-        clientlst.append((asnum,ts))
-    clientlst.sort(key=lambda tup: tup[1])
-    return [tup[0] for tup in clientlst]
-
-def findAS(lst):
-    cc_asn_d = json.load(open('cc_asn.json','r'))
-    asnlst = []
-    for cc in lst:
-        if cc in cc_asn_d:
-            asn = cc_asn_d[cc]
-            asnlst.append(asn)
-        else:
-            print(cc)
-    return asnlst
+    return capped_prob(lst, k).tolist()
 
-def calc_mobile(alpha, clientlst, args, num_hijack):
+# load guard bandwidths, resiliences and hijackers once
+def load_inputs(args):
     guard_as_bw = json.load(open(args.guard_file,'r'))
-    asn_lst = []
-    bw_lst = []
-    
-    for asn in guard_as_bw:
-        asn_lst.append(asn)
-        bw_lst.append(guard_as_bw[asn])
+    asn_lst = list(guard_as_bw.keys())
 
     #normalize bandwidth
-    s = sum([int(i) for i in bw_lst])
-    bw_lst = [float(i)/s for i in bw_lst]
+    s = sum([int(guard_as_bw[a]) for a in asn_lst])
+    bw = np.array([float(guard_as_bw[a])/s for a in asn_lst])
+
+    # {client: {guard: resilience}}; a binary store is memory-mapped
+    client_dict = resilstore.load(args.resil_file)
+
+    # hijack_dict: {client: {guard: [as1,as2,...]}}, or the bitset npz
+    if args.hijack_file.endswith('.npz'):
+        hijack_dict = np.load(args.hijack_file)
+    else:
+        hijack_dict = json.load(open(args.hijack_file,'r'))
+    return asn_lst, bw, client_dict, hijack_dict
 
-    client_dict = json.load(open(args.resil_file,'r'))
-    # sanity check to make sure all clients have values
-    for clientas in clientlst:
+# resiliences of one client as an array, and the guards of its columns;
+# a binary store gives a view of its matrix row
+def resil_row(client_dict, client):
+    if isinstance(client_dict, resilstore.ResilStore):
+        return client_dict.row(client), client_dict.guards
+    row = client_dict[client]
+    return np.fromiter(row.values(), dtype=np.float64, count=len(row)), list(row.keys())
+
+def check_clients(clientlst, client_dict, args):
+    # sanity check to make sure all clients have values, once per distinct client
+    uniq = list(dict.fromkeys(clientlst))
+    for clientas in uniq:
         if clientas not in client_dict:
             print("%s file failed on AS %s" % (args.client_file, clientas))
             sys.exit(0)
-
-    # hijack_dict: {client: {guard: [as1,as2,...]}}
-    hijack_dict = json.load(open(args.hijack_file,'r'))
-
-    sample_size = max(int(math.floor(len(guard_as_bw)*args.sample_size)),1)
-
-    firstclient = clientlst[0]
-    remain_client = clientlst[1:]
-
-    lst_w = []
-    curdict = client_dict[firstclient]
-    if sum(curdict.values()) == 0:
-        print("%s first client have all 0 values" % firstclient)
-        sys.exit(0)
-    d_keys = list(curdict.keys())
-    d_vals = recalcprob(list(curdict.values()),sample_size)
-    lst_w = []
-    for i in range(0,len(asn_lst)):
-        a = asn_lst[i]
-        r = d_vals[d_keys.index(a)] # new value
-        b = bw_lst[i]
-        weight = alpha * r + (1 - alpha) * float(b)
-        lst_w.append(weight)
-    total_w = sum(lst_w)
-    norm_w = [i/total_w for i in lst_w] # weight represents prob. of each guard being chosen
-
-    glst = []
-    # prob of being hijacked for first client
-    plst = []
-    hijackd = deepcopy(hijack_dict[firstclient])
-    for gd in hijackd:
-        hijackd[gd] = set(hijackd[gd])
-    for i in range(0,len(norm_w)):
-        a = asn_lst[i]
-        pr = norm_w[i] * float(len(hijackd[a]) / num_hijack) # prob. of being hijacked
-        plst.append(pr)
-    gval = sum(plst)
-    glst.append(gval)
-
-    #remain client
-    for rc in remain_client:
-        plst = []
-        # are the following lines necessary?
-        curdict = client_dict[rc]
-        if sum(curdict.values()) == 0:
-            print("%s client have all 0 values" % rc)
+    for i, rc in enumerate(uniq):
+        if resil_row(client_dict, rc)[0].sum() == 0:
+            print(("%s first client have all 0 values" if i == 0 else "%s client have all 0 values") % rc)
             sys.exit(0)
-        # get the current attacking AS and add to the list
+
+# The hijackers of each (client, guard) are a bitmask over the hijacking ASes
+# (packed into bytes): masks[c][g] for the distinct clients uniq, in order of
+# their first location, and the number of hijacking ASes
+def hijack_masks(clientlst, hijack_dict, asn_lst):
+    uniq = list(dict.fromkeys(clientlst))
+    if not isinstance(hijack_dict, dict):
+        # bitset: the rows of the trace clients, in asn_lst order
+        cidx = dict(zip(hijack_dict['clients'].tolist(), range(len(hijack_dict['clients']))))
+        gidx = dict(zip(hijack_dict['guards'].tolist(), range(len(hijack_dict['guards']))))
+        bits = hijack_dict['bits']
+        masks = bits[[cidx[c] for c in uniq]][:, [gidx[a] for a in asn_lst]]
+        return uniq, masks.reshape(len(uniq), len(asn_lst), bits.shape[-1]), len(hijack_dict['adversaries'])
+    ases = {}
+    rows, cols, bits = [], [], []
+    for c, rc in enumerate(uniq):
         cur_hd = hijack_dict[rc]
-        for gd in hijackd: # loop through each guard
-            hijackd[gd] = hijackd[gd] | set(cur_hd[gd])
-        for i in range(0,len(norm_w)):
-            pr_guard = norm_w[i]
-            a = asn_lst[i]
-            pr = norm_w[i] * float(len(hijackd[a]) / num_hijack) # prob. of being hijacked
-            plst.append(pr)
-        gval = sum(plst)
-        glst.append(gval)
-    return glst
+        for g, a in enumerate(asn_lst):
+            for h in cur_hd[a]:
+                rows.append(c)
+                cols.append(g)
+                bits.append(ases.setdefault(h, len(ases)))
+    masks = np.zeros((len(uniq), len(asn_lst), (len(ases) + 7) // 8), dtype=np.uint8)
+    bits = np.array(bits, dtype=np.int64)
+    np.bitwise_or.at(masks, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), bits >> 3),
+                     (1 << (bits & 7)).astype(np.uint8))
+    return uniq, masks, len(ases)
+
+# counts[g][t]: number of ASes hijacking asn_lst[g] for any of clientlst[:t+1]
+# The union along the trace is a cumulative OR of the masks and the set sizes
+# are popcounts.
+def hijack_counts(clientlst, hijack_dict, asn_lst):
+    uniq, masks, _ = hijack_masks(clientlst, hijack_dict, asn_lst)
+    cidx = dict(zip(uniq, range(len(uniq))))
+    seen = np.bitwise_or.accumulate(masks[[cidx[c] for c in clientlst]], axis=0)
+    return popcount(seen).T
+
+# probability of choosing each guard, for every alpha and sample size:
+# alpha * capped resilience of the first client + (1 - alpha) * bandwidth
+# row: resiliences of the first client to guards (see resil_row)
+# result: (alphas, sizes, guards)
+def guard_weights(row, guards, asn_lst, bw, alphas, sizes):
+    kidx = dict(zip(guards, range(len(guards))))
+    col = np.array([kidx[a] for a in asn_lst], dtype=np.int64)
+    r = capped_prob(row, sizes)[:, col]
+    alpha = np.asarray(alphas, dtype=np.float64).reshape(-1, 1, 1)
+    w = alpha * r[None] + (1 - alpha) * bw
+    return w / w.sum(axis=-1, keepdims=True)
+
+# hijack probability along the client timeline for a grid of alphas and
+# sample sizes (fractions of the guard ASes); the guard choice is made at the
+# first client and the hijackers accumulate over the later ones
+# returns the sample sizes and risk[alpha][size][client]
+def calc_sweep(alphas, fracs, clientlst, args, num_hijack):
+    asn_lst, bw, client_dict, hijack_dict = load_inputs(args)
+    check_clients(clientlst, client_dict, args)
+    stats.begin("risk")
+    stats.add(locations=len(clientlst), guards=len(asn_lst), grid=len(alphas) * len(fracs))
+    sizes = [max(int(math.floor(len(asn_lst)*f)),1) for f in fracs]
+    row, guards = resil_row(client_dict, clientlst[0])
+    weights = guard_weights(row, guards, asn_lst, bw, alphas, sizes)
+    counts = hijack_counts(clientlst, hijack_dict, asn_lst)
+    return sizes, weights.dot(counts / num_hijack)
+
+def calc_mobile(alpha, clientlst, args, num_hijack):
+    sizes, risk = calc_sweep([alpha], [args.sample_size], clientlst, args, num_hijack)
+    return risk[0][0].tolist()
+
+# Monte Carlo counterpart of calc_mobile: every simulated user picks a guard
+# with the calc_mobile weights and is hijacked by one of num_hijack ASes
+# returns the guard ASes, first_compromise counts and guard picks
+def calc_simulation(alpha, clientlst, args, num_hijack):
+    asn_lst, bw, client_dict, hijack_dict = load_inputs(args)
+    check_clients(clientlst, client_dict, args)
+    stats.begin("simulate")
+    stats.add(locations=len(clientlst), guards=len(asn_lst), users=args.simulate)
+    size = max(int(math.floor(len(asn_lst)*args.sample_size)),1)
+    row, guards = resil_row(client_dict, clientlst[0])
+    weights = guard_weights(row, guards, asn_lst, bw, [alpha], [size])[0][0]
+    uniq, masks, num_ases = hijack_masks(clientlst, hijack_dict, asn_lst)
+    if num_ases > num_hijack:
+        print("%d hijacking ASes found, more than --num_hijack %d" % (num_ases, num_hijack))
+        num_hijack = num_ases
+    first_loc = {}
+    for i, c in enumerate(clientlst):
+        first_loc.setdefault(c, i)
+    first = guardsim.first_exposure(masks, [first_loc[c] for c in uniq], num_hijack, len(clientlst))
+    counts, picks = guardsim.simulate(weights, first, len(clientlst), args.simulate,
+                                      args.seed, args.chunk)
+    expected = weights.dot(popcount(np.bitwise_or.reduce(masks, axis=0))) / num_hijack
+    print("compromised by the last location: %.6f simulated, %.6f expected"
+          % (1 - counts[-1] / float(args.simulate), expected))
+    return asn_lst, counts, picks
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -158,19 +216,64 @@ def parse_args():
     parser.add_argument("--client_file",
                         default="./all_ases.txt")
     parser.add_argument("--sample_size", type=float, default=0.1)
+    parser.add_argument("--alpha", type=float, default=0.5)
+    parser.add_argument("--num_hijack", type=int, default=50,
+                        help="number of hijacking ASes")
+    parser.add_argument("--sweep_alpha", type=float, nargs='+', default=None,
+                        help="alphas of a sweep (default: --alpha)")
+    parser.add_argument("--sweep_sample_size", type=float, nargs='+', default=None,
+                        help="sample sizes of a sweep (default: --sample_size)")
+    parser.add_argument("--simulate", type=int, default=None,
+                        help="number of simulated users (Monte Carlo instead of expected risk)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk", type=int, default=1 << 20,
+                        help="simulated users drawn at once")
+    parser.add_argument("--stats", default=None,
+                        help="append per phase statistics (JSON lines) to this file")
     return parser.parse_args()
 
+stats = instrument.Stats(None, "client_country")
+
 def main(args):
-    clientlst = orderClient(args.client_file)
-    clientlst = findAS(clientlst)
+    global stats
+    stats = instrument.Stats(args.stats, "client_country")
+    stats.begin("load")
+    # client ASes in time order, locations without an AS are printed and skipped
+    clientlst, unknown = traces.locate(traces.load(args.client_file), traces.load_cc_asn('cc_asn.json'))
+    for cc in unknown:
+        print(cc)
     print("Number of ASes is %d" % len(clientlst))
     
-    num_hijack = 50 # hardcoded number of hijacking ASes
-    new_resil = calc_mobile(0.5, clientlst, args, num_hijack)
+    if args.sweep_alpha or args.sweep_sample_size:
+        alphas = args.sweep_alpha or [args.alpha]
+        fracs = args.sweep_sample_size or [args.sample_size]
+        sizes, risk = calc_sweep(alphas, fracs, clientlst, args, args.num_hijack)
+        stats.begin("dump")
+        outfile = 'dat_files/%d_%s.sweep.npz' % (len(clientlst), basename(args.client_file))
+        np.savez_compressed(outfile, alpha=alphas, sample_size=fracs,
+                            sample_count=sizes, clients=clientlst, risk=risk)
+        print("%d alphas x %d sample sizes written to %s" % (len(alphas), len(fracs), outfile))
+        stats.close()
+        return
+
+    if args.simulate:
+        asn_lst, counts, picks = calc_simulation(args.alpha, clientlst, args, args.num_hijack)
+        stats.begin("dump")
+        outfile = 'dat_files/%d_%s.sim.npz' % (len(clientlst), basename(args.client_file))
+        np.savez_compressed(outfile, alpha=args.alpha, sample_size=args.sample_size,
+                            seed=args.seed, users=args.simulate, clients=clientlst,
+                            first_compromise=counts, guard=asn_lst, picks=picks)
+        print("%d simulated users written to %s" % (args.simulate, outfile))
+        stats.close()
+        return
+
+    new_resil = calc_mobile(args.alpha, clientlst, args, args.num_hijack)
 
+    stats.begin("dump")
     with open('dat_files/%d_%s' % (len(clientlst), basename(args.client_file)), 'w+') as fout:
         for g in new_resil: #ratio_resil:
             fout.write(str(g) + '\n')
+    stats.close()
 
 
 if __name__ == '__main__':
@@ -6,42 +6,42 @@
 # Input:
 # List of Tor client ASes (--client_file, default="data/top400client.txt")
 # Tor guard relay bandwidth (--guard_file, default="data/guard_as_bw.json")
-# Predicted paths between client and guard (--path_file, default="data/cg_path.json")
+# Predicted paths between client and guard (--client_path, default="data/cg_path.json",
+#   or the binary cg_path.bin written by predictpath.py --output_format binary)
 # Output:
 # New percentages for each client AS ([clientAS].txt)
+# Batch mode (--batch, a directory of traces or a manifest listing one trace
+# file per line) loads the shared inputs once and writes the risk of every
+# trace to result_files/batch_[name].npz ([name]: directory or manifest name):
+#   trace[n], offset[n+1], risk[offset[i]:offset[i+1]] for trace[i]
+# --simulate [users] draws guards and adversaries for that many simulated
+# users per trace (common/guardsim.py, --seed, --chunk): time to first
+# compromise first_compromise[location] (never compromised last) and guard
+# picks, in result_files/[n]_[client_file].sim.npz, or in the batch file as
+#   guard[g], picks[i][g], first_compromise[offset[i]+i:offset[i+1]+i+1]
+# --topk N takes the first N ASes of the ranked --topas_file as adversaries
+# and also gives the risk of every top-k adversary set, k = 1..N, after each
+# location: topk[k-1][t], in result_files/[n]_[client_file].topk.npz, or in
+# the batch file as adversaries[N], topk[k-1][offset[i]:offset[i+1]]
+# --stats [file] appends run statistics as JSON lines, see common/instrument.py
 ##################################################
 
 
+import os
 import sys
 import json
 import argparse
-import datetime
-import time
 from os.path import basename
-from collections import defaultdict
-
-
-def orderClient(filename):
-    clientlst = []
-    for line in open(filename, 'r'):
-        asnum = line.split()[0]
-        tsstr = ' '.join(line.strip().split()[1:])
-        ts = int(time.mktime(datetime.datetime.strptime(tsstr, "%Y-%m-%d %H:%M:%S").timetuple()))
-        clientlst.append((asnum,ts))
-    clientlst.sort(key=lambda tup: tup[1])
-    return [tup[0] for tup in clientlst]
-
-def findAS(lst):
-    cc_asn_d = json.load(open('data/cc_asn.json','r'))
-    asnlst = []
-    for cc in lst:
-        if cc in cc_asn_d:
-            asn = cc_asn_d[cc]
-            asnlst.append(asn)
-        else:
-            #print(cc)
-            continue
-    return asnlst
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+import pathstore
+import traces
+import instrument
+import guardsim
+import workers
+from bitsets import BITS, popcount
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -53,53 +53,216 @@ def parse_args():
                         default="data/top50ases.txt")
     parser.add_argument("--client_file",
                         default="")
+    parser.add_argument("--batch", default=None,
+                        help="directory of traces, or a file listing one trace per line")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes computing traces in parallel")
+    parser.add_argument("--simulate", type=int, default=None,
+                        help="number of simulated users per trace")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the simulation, trace i of a batch uses (seed, i)")
+    parser.add_argument("--chunk", type=int, default=1 << 20,
+                        help="simulated users drawn at once")
+    parser.add_argument("--topk", type=int, default=None,
+                        help="risk of every top-k adversary set up to the first N ASes of --topas_file")
+    parser.add_argument("--stats", default=None,
+                        help="append per phase statistics (JSON lines) to this file")
     return parser.parse_args()
 
+# inputs shared by all traces of a batch
+def load_shared(args):
+    global cg_path, cc_asn_d, topas_idx, guard_lst, guard_bw, risk_norm, guard_share, guard_w, masks
+    cg_path = pathstore.load(args.client_path)
+    bw_path = json.load(open(args.guard_path, 'r'))
+    cc_asn_d = traces.load_cc_asn('data/cc_asn.json')
+    # adversaries in rank order
+    topas_lst = list(dict.fromkeys([line.strip() for line in open(args.topas_file,'r')]))
+    # (query_server.py has no --topk)
+    if getattr(args, 'topk', None):
+        topas_lst = topas_lst[:args.topk]
+    topas_idx = dict(zip(topas_lst, range(len(topas_lst))))
+    guard_lst = []
+    for client in cg_path:
+        guard_lst = list(cg_path[client])
+        break
+    # per-location risk is sum(on-path adversaries * bandwidth) / (adversaries * total bandwidth)
+    guard_bw = np.array([bw_path[g] for g in guard_lst], dtype=np.float64)
+    risk_norm = len(topas_idx) * sum(bw_path.values())
+    guard_share = guard_bw / sum(bw_path.values())
+    guard_w = guard_share / len(topas_idx)
+    masks = {}
+
+# masks[client][g]: adversary ASes on the paths to guard_lst[g], as packed bits
+def client_mask(client):
+    if client not in masks:
+        mask = np.zeros((len(guard_lst), (len(topas_idx) + 7) // 8), dtype=np.uint8)
+        entry = cg_path[client]
+        for g, guard in enumerate(guard_lst):
+            if isinstance(entry, pathstore.ClientPaths):
+                ases = entry.store.on_path(client, guard)
+            else:
+                ases = entry[guard][0] + entry[guard][1]
+            for asn in ases:
+                i = topas_idx.get(asn)
+                if i is not None:
+                    mask[g][i >> 3] |= 1 << (i & 7)
+        masks[client] = mask
+    return masks[client]
+
+# risk after each location of a trace: adversaries accumulate over the
+# locations visited so far (cumulative OR of the masks)
+def trace_risk(clientlst):
+    if not clientlst:
+        return np.zeros(0)
+    seen = np.bitwise_or.accumulate(np.array([client_mask(c) for c in clientlst]), axis=0)
+    counts = popcount(seen)
+    # summed guard by guard in guard_lst order, as the per-guard loop this
+    # replaced, so that single traces keep the same digits
+    risk = np.zeros(len(clientlst))
+    for g in range(len(guard_lst)):
+        risk += counts[:, g] * guard_bw[g] / risk_norm
+    return risk
+
+# risk after each location for every top-k adversary set, k = 1..N:
+# topk[k-1][t] = sum(on-path adversaries of rank < k * bandwidth) / (k * total bandwidth)
+# the bandwidth share watched by each rank, cumulated over the ranks
+def trace_topk(clientlst):
+    num_adv = len(topas_idx)
+    if not clientlst:
+        return np.zeros((num_adv, 0))
+    seen = np.bitwise_or.accumulate(np.array([client_mask(c) for c in clientlst]), axis=0)
+    share = np.zeros((len(clientlst), seen.shape[-1] * 8))
+    for b in range(seen.shape[-1]):
+        # one byte (8 ranks) at a time keeps the unpacked bits small
+        share[:, 8*b:8*b+8] = np.einsum('tgj,g->tj', BITS[seen[:, :, b]], guard_share)
+    return (np.cumsum(share[:, :num_adv], axis=1) / np.arange(1, num_adv + 1)).T
+
+# simulated users of a trace: they pick a guard by bandwidth at the first
+# location and are watched by one of the adversary ASes
+# returns first_compromise counts and guard picks
+def trace_simulation(clientlst, users, seed, chunk):
+    uniq = list(dict.fromkeys(clientlst))
+    first_loc = {}
+    for i, c in enumerate(clientlst):
+        first_loc.setdefault(c, i)
+    masks = np.array([client_mask(c) for c in uniq], dtype=np.uint8).reshape(
+        len(uniq), len(guard_lst), (len(topas_idx) + 7) // 8)
+    first = guardsim.first_exposure(masks, [first_loc[c] for c in uniq], len(topas_idx), len(clientlst))
+    return guardsim.simulate(guard_w, first, len(clientlst), users, seed, chunk)
+
+def init_worker(args):
+    if cg_path is None:
+        load_shared(args)
+
+# task: (slot, trace file, None or (users, seed, chunk) to simulate, top-k risk)
+def solve_trace(task):
+    slot, filename, sim, topk = task
+    clientlst, _ = traces.locate(traces.load(filename), cc_asn_d)
+    if sim is not None:
+        sim = trace_simulation(clientlst, *sim)
+    return slot, trace_risk(clientlst), sim, trace_topk(clientlst) if topk else None
+
+def run_traces(tasks, args):
+    # yields (slot, risk, simulation, top-k risk) as traces complete
+    return workers.imap(solve_trace, tasks, args.workers, init_worker, (args,), chunksize=16)
+
+def list_traces(batch):
+    # trace files only, not their .trc caches
+    if os.path.isdir(batch):
+        return sorted([os.path.join(batch, f) for f in os.listdir(batch)
+                       if os.path.isfile(os.path.join(batch, f)) and
+                       not f.endswith('.trc') and not f.endswith('.tmp')])
+    return [line.strip() for line in open(batch, 'r') if line.strip()]
+
+def run_batch(args):
+    trace_files = list_traces(args.batch)
+    load_shared(args)
+    print("%d traces, %d guards, %d adversary ASes" % (len(trace_files), len(guard_lst), len(topas_idx)))
+    stats.begin("risk")
+    risk = [None] * len(trace_files)
+    sims = [None] * len(trace_files)
+    topks = [None] * len(trace_files)
+    tasks = [(slot, f, (args.simulate, (args.seed, slot), args.chunk) if args.simulate else None,
+              bool(args.topk)) for slot, f in enumerate(trace_files)]
+    for slot, r, sim, topk in run_traces(tasks, args):
+        risk[slot] = r
+        sims[slot] = sim
+        topks[slot] = topk
+    stats.add(traces=len(trace_files), locations=sum([len(r) for r in risk]))
+    stats.begin("dump")
+    offset = np.zeros(len(trace_files) + 1, dtype=np.int64)
+    offset[1:] = np.cumsum([len(r) for r in risk])
+    outfile = 'result_files/batch_%s.npz' % os.path.splitext(basename(os.path.normpath(args.batch)))[0]
+    arrays = {}
+    if args.simulate:
+        arrays = dict(guard=np.array(guard_lst), users=args.simulate, seed=args.seed,
+                      picks=np.array([s[1] for s in sims]).reshape(len(sims), len(guard_lst)),
+                      first_compromise=np.concatenate([s[0] for s in sims] + [np.zeros(0, dtype=np.int64)]))
+    if args.topk:
+        arrays.update(adversaries=np.array(list(topas_idx)),
+                      topk=np.concatenate(topks + [np.zeros((len(topas_idx), 0))], axis=1))
+    np.savez_compressed(outfile, trace=np.array(trace_files),
+                        offset=offset, risk=np.concatenate(risk + [np.zeros(0)]), **arrays)
+    print("%d locations written to %s" % (offset[-1], outfile))
+
+cg_path = None
+stats = instrument.Stats(None, "guard_as_country")
+
+def run_simulation(args, clientlst):
+    stats.begin("simulate")
+    stats.add(locations=len(clientlst), users=args.simulate)
+    counts, picks = trace_simulation(clientlst, args.simulate, args.seed, args.chunk)
+    risk = trace_risk(clientlst)
+    if len(risk):
+        print("compromised by the last location: %.6f simulated, %.6f expected"
+              % (1 - counts[-1] / float(args.simulate), risk[-1]))
+    stats.begin("dump")
+    outfile = 'result_files/%d_%s.sim.npz' % (len(clientlst), basename(args.client_file))
+    np.savez_compressed(outfile, seed=args.seed, users=args.simulate, clients=clientlst,
+                        first_compromise=counts, guard=np.array(guard_lst), picks=picks)
+    print("%d simulated users written to %s" % (args.simulate, outfile))
+
+def run_topk(args, clientlst):
+    stats.begin("topk")
+    stats.add(locations=len(clientlst), adversaries=len(topas_idx))
+    topk = trace_topk(clientlst)
+    stats.begin("dump")
+    outfile = 'result_files/%d_%s.topk.npz' % (len(clientlst), basename(args.client_file))
+    np.savez_compressed(outfile, clients=clientlst, adversaries=np.array(list(topas_idx)), topk=topk)
+    print("top-k risk for k = 1..%d written to %s" % (len(topas_idx), outfile))
+
 def main(args):
-    # load files
+    global stats
+    stats = instrument.Stats(args.stats, "guard_as_country")
+    stats.begin("load")
+    if args.batch:
+        run_batch(args)
+        stats.close()
+        return
     # {client: {guard: [[path1,path2],[path1,path2]]}} in which guard:[forward,reverse]
-    cg_path = json.load(open(args.client_path, 'r'))
-    bw_path = json.load(open(args.guard_path, 'r'))
-    
-    sum_weight = sum(bw_path.values())
-    
-    # load files
-    clientlst = orderClient(args.client_file)
-    clientlst = findAS(clientlst)
+    # a binary path store is memory-mapped and only the pairs used are decoded
+    load_shared(args)
+    # client ASes in time order, locations without an AS are skipped
+    clientlst, _ = traces.locate(traces.load(args.client_file), cc_asn_d)
     print("Number of client ASes is %d" % len(clientlst))
-    
-    # We only consider CAIDA top 50 ASes as adversary
-    topas_lst = set([line.strip() for line in open(args.topas_path,'r')])
-
-    num_d = defaultdict(list)
-    set_d = defaultdict(set) # {guard: [accumulative on-path ASes]}
-
-    for client in clientlst: # loop through each client AS location
-        for guard in cg_path[client]: # loop through each possible guard
-            cur_set = set_d[guard]
-            tmp_set = set(cg_path[client][guard][0] + cg_path[client][guard][1]) & topas_lst
-            if cur_set:
-                new_set = cur_set | tmp_set
-                set_d[guard] = new_set
-                num_d[guard].append(len(new_set))
-            else: # first location
-                set_d[guard] = tmp_set
-                num_d[guard].append(len(set_d[guard]))
-
-    # Total number of adversary ASes
-    num_ases = len(topas_lst)
-    
-    glst = []
-    for i in range(0,len(clientlst)):
-        glst.append(0)
-    for guard in num_d:
-        for i in range(0,len(num_d[guard])):
-            glst[i] += num_d[guard][i] * bw_path[guard] / (num_ases * sum_weight)
+    if args.simulate or args.topk:
+        if args.simulate:
+            run_simulation(args, clientlst)
+        if args.topk:
+            run_topk(args, clientlst)
+        stats.close()
+        return
+
+    stats.begin("risk")
+    stats.add(locations=len(clientlst))
+    risk = trace_risk(clientlst)
 
     # format:
+    stats.begin("dump")
     with open('result_files/%d_%s' % (len(clientlst), basename(args.client_file)), 'w+') as fout:
-        for g in glst:
+        for g in risk.tolist():
             fout.write(str(g) + '\n')
+    stats.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# pathoracle.py
+# on-demand AS path queries with the predictpath BFS (traversal.routes_to)
+# Usage:
+#   oracle = PathOracle("data/20161001.as-rel2.txt")
+#   oracle.path(src, dst)           # lowest-ASN shortest valley-free path
+#   oracle.paths(src, dst)          # all of them (all_paths=True)
+#   oracle.on_path_ases(src, dst)   # set of ASes on the path(s)
+#   oracle.query(pairs, "path")     # batch, one route tree per destination
+# A route tree is built per destination (the BFS root, like the guard of a
+# forward path in predictpath) and kept in an LRU cache of cache_size trees.
+# Paths run from src to dst and match the entries of cg_path.json: the
+# forward path of (client, guard) is path(client, guard), the reverse path
+# path(guard, client).
+# With route_cache (a predictpath --route_cache directory) trees are also
+# read from and written to the on-disk cache shared with predictpath.
+##################################################
+
+from collections import OrderedDict
+
+import topology
+import traversal
+from routecache import RouteCache
+
+
+class PathOracle(object):
+    def __init__(self, topology_file=None, topo=None, all_paths=False, cache_size=128,
+                 route_cache=None, route_cache_size=4096):
+        self.topo = topo if topo is not None else topology.load(topology_file)
+        # best keeps one path per node; tree can enumerate all of them
+        self.engine = "tree" if all_paths else "best"
+        self.cache_size = cache_size
+        self.trees = OrderedDict() # destination ASN -> route tree
+        self.disk = None
+        if route_cache:
+            self.disk = RouteCache(route_cache, self.topo.digest, self.engine,
+                                   route_cache_size * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+
+    def tree(self, dst):
+        # route tree towards dst, None if dst is not in the topology
+        if dst in self.trees:
+            self.trees.move_to_end(dst)
+            self.hits += 1
+            return self.trees[dst]
+        if dst not in self.topo:
+            return None
+        self.misses += 1
+        graph = self.disk.get(dst) if self.disk is not None else None
+        if graph is None:
+            graph = traversal.routes_to(self.topo, self.topo.index[dst],
+                                        traversal.path_model(self.engine, self.topo))
+            if self.disk is not None:
+                self.disk.put(dst, graph)
+        self.trees[dst] = graph
+        while len(self.trees) > self.cache_size:
+            self.trees.popitem(last=False)
+        return graph
+
+    def routes(self, src, dst):
+        graph = self.tree(dst)
+        node = self.topo.index.get(src)
+        if graph is None or node is None or node not in graph:
+            return None
+        # best path cell in best mode, the route in tree mode
+        return graph[node][2] if self.engine == "best" else graph[node]
+
+    def path(self, src, dst):
+        # the path predictpath keeps with tiebreak, None if there is none
+        routes = self.routes(src, dst)
+        if routes is None:
+            return None
+        names = self.topo.names
+        if self.engine == "best":
+            return [names[x] for x in traversal.cell_path(routes)]
+        return [names[x] for x in min(traversal.iter_paths(routes))]
+
+    def paths(self, src, dst):
+        # all shortest valley-free paths, as predictpath --notiebreak
+        if self.engine != "tree":
+            raise ValueError("PathOracle keeps one path per pair unless all_paths is set")
+        routes = self.routes(src, dst)
+        if routes is None:
+            return []
+        names = self.topo.names
+        return [[names[x] for x in p] for p in traversal.iter_paths(routes)]
+
+    def on_path_ases(self, src, dst):
+        # ASes on the path from src to dst (on any of the paths with all_paths)
+        if self.engine == "tree":
+            ases = set()
+            for p in self.paths(src, dst):
+                ases.update(p)
+            return ases
+        p = self.path(src, dst)
+        return set(p) if p is not None else set()
+
+    def query(self, pairs, kind="path"):
+        # answer [(src, dst), ...] with path, paths or on_path_ases, in order;
+        # pairs are grouped by destination so each tree is built once
+        method = {"path": self.path, "paths": self.paths, "on_path_ases": self.on_path_ases}[kind]
+        groups = OrderedDict()
+        for i, (src, dst) in enumerate(pairs):
+            groups.setdefault(dst, []).append(i)
+        result = [None] * len(pairs)
+        for dst in groups:
+            for i in groups[dst]:
+                result[i] = method(pairs[i][0], dst)
+        return result
@@ -7,128 +7,75 @@
 # List of Tor client ASes (--client_file, default="data/top400client.txt")
 # List of Tor guard ASes (--guard_as_file, default="data/as_guard.txt")
 # CAIDA AS topology (--topology_file, default="data/20161001.as-rel2.txt")
+# Optionally, the previous snapshot and its output (--prev_topology_file,
+# --prev_output): the roots whose paths cannot have changed are carried
+# forward from the previous output instead of recomputed, see SnapshotDiff
 # Output:
-# Predicted paths between clients and guards (data/cg_path.json)
+# Predicted paths between clients and guards (data/cg_path.json, or
+# data/cg_path.bin with --output_format binary, see common/pathstore.py)
+# With --study name:source_file:destination_file (repeatable) paths are
+# computed between any endpoint sets instead, e.g. clients and guards plus
+# exits and destinations: every distinct AS of all studies is the root of one
+# BFS, whose paths are fanned out to data/[name].json ({source: {destination:
+# [forward, reverse]}}, or .bin), so overlapping studies share their roots.
+# With --journal [file] the paths of every root are appended to the journal
+# as the root completes instead of being kept in memory, and the output is
+# written from the journal one client at a time at the end (forward roots are
+# stored per client, see Journal.append_parts); --resume continues an
+# interrupted run, skipping the roots already in the journal (see common/journal.py).
+# --stats [file] appends run statistics as JSON lines, see common/instrument.py;
+# the path length checks after every BFS phase only run with --debug
 ##################################################
 
+import os
 import sys
 import json
-from collections import deque
 import time
 import argparse
+import itertools
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+import topology
+from routecache import RouteCache
+import pathstore
+import instrument
+import workers
+import traversal
+from traversal import iter_paths, cell_path
+from journal import Journal
 
-# use BFS to traverse the graph given a destination
-# graph[source] = [type,path1,path2], in which type is 0 (p-c), 1 (p-p), or 2 (c-p)
 
-# initialize graph
-def init(root):
-    global graph
-    graph = {}
-    graph[root] = [0,[root]]
-
-def bfs_cp(root):
-    global graph, asdict
-    q = deque([root])
-    while q:
-        current = q.popleft()
-        cur_len = len(graph[current][1])
-        cur_path = graph[current][1:]
-        for node in asdict[current][2]:
-            if node in graph:
-                path_len = len(graph[node][1])
-                if path_len == (cur_len + 1):
-                    for each in cur_path:
-                        newpath = [node] + each
-                        graph[node].append(newpath)
-                elif path_len > (cur_len + 1):
-                    print("we have problem for cur node %s and its cp node %s" % (current,node))
-                else:
-                    pass
-            else:
-                graph[node] = [0]
-                for each in cur_path:
-                    newpath = [node] + each
-                    graph[node].append(newpath)
-                q.append(node)
-    # sanity check
-    for n in graph:
-        len_lst = [len(x) for x in graph[n][1:]]
-        if len(set(len_lst)) != 1:
-            print("we have a problem in customer-provider")
-            print(n)
-            print(graph[n])
+# routes towards a root are computed by traversal.routes_to; graph holds the
+# labels of the last root, graph[source] = [type, ...] in which type is
+# 0 (p-c), 1 (p-p), or 2 (c-p), see traversal.path_model for each engine.
+# nodes and paths hold topology indices; they are mapped back to ASNs on output
 
-def bfs_pp(q_lst):
-    global graph, asdict
-    for current in q_lst:
-        cur_len = len(graph[current][1])
-        cur_path = graph[current][1:]
-        for node in asdict[current][1]:
-            if node in graph:
-                path_type = graph[node][0]
-                path_len = len(graph[node][1])
-                if path_type == 1 and path_len == (cur_len + 1):
-                    for each in cur_path:
-                        newpath = [node] + each
-                        graph[node].append(newpath)
-                elif path_type == 1 and path_len > (cur_len + 1):
-                    graph[node] = [1]
-                    for each in cur_path:
-                        newpath = [node] + each
-                        graph[node].append(newpath)
-                else:
-                    pass
-            else:
-                graph[node] = [1]
-                for each in cur_path:
-                    newpath = [node] + each
-                    graph[node].append(newpath)
-    # sanity check
+# sanity check (--debug, paths engine): all paths of a node have the same length
+def check_paths(graph, phase):
     for n in graph:
         len_lst = [len(x) for x in graph[n][1:]]
         if len(set(len_lst)) != 1:
-            print("we have a problem in peer-peer")
-            print(n)
+            print("we have a problem in %s" % phase)
+            print(topo.name(n))
             print(graph[n])
 
-def bfs_pc(q_lst):
-    global graph, asdict
-    q = deque(q_lst)
-    while q:
-        current = q.popleft()
-        cur_len = len(graph[current][1])
-        cur_path = graph[current][1:]
-        for node in asdict[current][0]:
-            if node in graph:
-                path_type = graph[node][0]
-                path_len = len(graph[node][1])
-                if path_type == 2 and path_len == (cur_len + 1):
-                    for each in cur_path:
-                        newpath = [node] + each
-                        graph[node].append(newpath)
-                elif path_type == 2 and path_len > (cur_len + 1):
-                    graph[node] = [2]
-                    for each in cur_path:
-                        newpath = [node] + each
-                        graph[node].append(newpath)
-                else:
-                    pass
-            else:
-                graph[node] = [2]
-                for each in cur_path:
-                    newpath = [node] + each
-                    graph[node].append(newpath)
-                q.append(node)
-
-    # sanity check
-    for n in graph:
-        len_lst = [len(x) for x in graph[n][1:]]
-        if len(set(len_lst)) != 1:
-            print("we have a problem in provider-customer")
-            print(n)
-            print(graph[n])
+# work of the last route_root for --stats: nodes reached, adjacency entries
+# scanned and path objects held (paths, or route objects/cells in tree and
+# best mode). Every node is dequeued once per phase it takes part in: nodes
+# reached in the cp phase (type 0) scan their providers, peers and customers,
+# the others only their customers.
+def root_stats(engine):
+    adj = topo.adj
+    edges = 0
+    paths = 0
+    for n, route in graph.items():
+        edges += len(adj[topology.PC][n])
+        if route[0] == 0:
+            edges += len(adj[topology.CP][n]) + len(adj[topology.PP][n])
+        paths += len(route) - 1 if engine == "paths" else 1
+    return {"nodes": len(graph), "edges": edges, "paths": paths}
 
+# topology indices follow ASN order, so int() keeps the ASN comparison
 def getPath(lst,sdex):
     tmplst = [int(x[sdex]) for x in lst]
     minasn = min(tmplst)
@@ -150,44 +97,416 @@ def parse_args():
     parser.add_argument("--guard_as_file",
                         default="data/as_guard.txt")
     parser.add_argument("--notiebreak", action="store_true")
-    return parser.parse_args()
+    # paths: materialize every equal-length path during the BFS
+    # tree: keep a predecessor DAG per root and enumerate paths on output
+    # best: tiebreak by router ID inside the BFS (default unless --notiebreak)
+    parser.add_argument("--engine", choices=["paths", "tree", "best"],
+                        default=None)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes computing roots in parallel")
+    # per-root route trees are reused across runs with the same topology;
+    # cached trees are built with the best engine, or tree with --notiebreak
+    parser.add_argument("--route_cache", default=None,
+                        help="directory of the per-root route tree cache (sets the engine)")
+    parser.add_argument("--route_cache_size", type=int, default=4096,
+                        help="route tree cache size cap in MB")
+    parser.add_argument("--output_format", choices=["json", "binary"],
+                        default="json")
+    parser.add_argument("--stats", default=None,
+                        help="append per phase and per root statistics (JSON lines) to this file")
+    parser.add_argument("--debug", action="store_true",
+                        help="check path lengths after every BFS phase")
+    parser.add_argument("--journal", default=None,
+                        help="append the results of every root to this file (e.g. data/cg_path.journal)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the roots already in --journal")
+    parser.add_argument("--study", action="append", default=None,
+                        help="name:source_file:destination_file, paths between two AS sets "
+                             "written to data/[name].json (repeatable, replaces the client/guard run)")
+    parser.add_argument("--prev_topology_file", default=None,
+                        help="topology of the previous snapshot")
+    parser.add_argument("--prev_output", default=None,
+                        help="cg_path output (json or binary) computed on --prev_topology_file")
+    args = parser.parse_args()
+    if args.resume and not args.journal:
+        parser.error("--resume needs --journal")
+    if bool(args.prev_topology_file) != bool(args.prev_output):
+        parser.error("--prev_topology_file and --prev_output go together")
+    if args.study:
+        if args.journal:
+            parser.error("--study cannot be used with --journal")
+        if args.prev_output:
+            parser.error("--study cannot be used with --prev_output")
+        for spec in args.study:
+            if len(spec.split(':')) != 3 or not all(spec.split(':')):
+                parser.error("--study must be name:source_file:destination_file")
+    if args.route_cache:
+        engine = "tree" if args.notiebreak else "best"
+        if args.engine not in (None, engine):
+            parser.error("--route_cache uses the %s engine%s, it cannot be used with --engine %s"
+                         % (engine, " with --notiebreak" if args.notiebreak else "", args.engine))
+        args.engine = engine
+    if args.engine is None:
+        args.engine = "paths" if args.notiebreak else "best"
+    elif args.engine == "best" and args.notiebreak:
+        parser.error("--engine best keeps one path per node and cannot be used with --notiebreak")
+    return args
 
-def main(args):
-    global asdict, graph
-    asdict = {}
-
-    # load AS relationships from CAIDA topo file
-    # asdict[asn] = [[provider-customer edges],[peer-to-peer edges],[customer-provider edges]]
-    for line in open(args.topology_file):
-        if not line.strip().startswith("#"):
-            arr = line.strip().split('|')
-            asn1 = arr[0]
-            asn2 = arr[1]
-            rel = int(arr[2]) # -1: provider-customer; 0: peer-to-peer
-            if asn1 in asdict:
-                asdict[asn1][rel+1].append(asn2)
+# run the three BFS phases with the given root as destination
+def route_root(root, engine):
+    global graph
+    check = check_paths if debug and engine == "paths" else None
+    graph = traversal.routes_to(topo, root, traversal.path_model(engine, topo), check)
+
+# paths from node to the current root: a path list, a route in tree mode
+# or the best path cell in best mode
+def get_routes(node, engine):
+    if engine == "best":
+        return graph[node][2]
+    if engine == "tree":
+        return graph[node]
+    return graph[node][1:]
+
+# per-process state for solve_root; set in the parent when running sequentially
+def init_worker(cachefile, digest, engine, tiebreak, targets, cache, measure=False, check=False):
+    global topo, worker_conf, debug
+    topo = topology.attach(topo, cachefile, digest)
+    worker_conf = (engine, tiebreak, targets, cache, measure)
+    debug = check
+
+# compute the routes towards one root and return the paths (as ASNs) of the
+# sources of that direction: forward roots are guards with clients as
+# sources, reverse roots are clients with guards as sources (with --study,
+# direction is the index of the root's source list in targets).
+# Each entry is None if not reached, the chosen path when tiebreaking,
+# or the list of all equal-length paths otherwise.
+# With --stats the work of the root is returned too (None otherwise).
+def solve_root(task):
+    global graph
+    direction, root = task
+    engine, tiebreak, targets, cache, measure = worker_conf
+    if measure:
+        start = instrument.clock()
+    tree = cache.get(root) if cache is not None else None
+    if tree is not None:
+        graph = tree
+    else:
+        route_root(topo.index[root], engine)
+        if cache is not None:
+            cache.put(root, graph)
+    names = topo.names
+    result = []
+    for asn in targets[direction]:
+        node = topo.index.get(asn)
+        if node is None or node not in graph:
+            result.append(None)
+            continue
+        routes = get_routes(node, engine)
+        if not tiebreak:
+            if engine == "tree":
+                routes = iter_paths(routes)
+            result.append([[names[x] for x in p] for p in routes])
+        elif engine == "best":
+            result.append([names[x] for x in cell_path(routes)])
+        elif engine == "tree":
+            # same lowest-ASN path as getPath, one path in memory at a time
+            result.append([names[x] for x in min(iter_paths(routes))])
+        else:
+            result.append([names[x] for x in getPath(routes,0)])
+    work = None
+    if measure:
+        work = instrument.elapsed(start)
+        work.update(root_stats(engine), cached=int(tree is not None))
+    return direction, root, result, tree is not None, work
+
+def run_roots(tasks, args):
+    # yields (direction, root, result, cached, work) as roots complete
+    return workers.imap(solve_root, tasks, args.workers, init_worker, worker_args)
+
+class SnapshotDiff(object):
+    # Which roots give the same paths to the sources on the previous
+    # topology (old) and on this one (new). For a root r, the labels of the
+    # sources only depend on
+    # (a) the provider lists of A, the up-cone of r (the ASes labeled in the
+    #     customer-provider phase, in that order),
+    # (b) the peer lists of A, restricted to U, the up-cone of the sources,
+    # (c) the provider sets of U and the customer lists of U restricted to U:
+    #     labels only flow from provider to customer in the provider-customer
+    #     phase, so the ASes outside U never change the labels of U or their
+    #     order in the queue.
+    # The ASes of U failing (c) are found once; they only matter to roots
+    # for which they have a customer or peer route (in A or a peer of A),
+    # since such a label does not depend on their providers.
+    # Lists are compared by ASN, in order; all ASes are old indices.
+    def __init__(self, old, new, sources):
+        self.old = old
+        self.new = new
+        self.providers = {}
+        self.peers = {}
+        if not all([s in old for s in sources]):
+            # no previous paths for the new sources
+            self.cone = None
+            return
+        self.cone = set(topology.up_cone(old, [old.index[s] for s in sources]))
+        self.cone_asn = set([old.asn[u] for u in self.cone])
+        self.moved = set()
+        for u in self.cone:
+            j = new.index.get(old.names[u])
+            if j is None or set(self.neighbors(old, topology.CP, u)) != set(self.neighbors(new, topology.CP, j)):
+                self.moved.add(u)
+                continue
+            a = [x for x in self.neighbors(old, topology.PC, u) if x in self.cone_asn]
+            b = [x for x in self.neighbors(new, topology.PC, j) if x in self.cone_asn]
+            if a != b:
+                # added or removed customers changed their provider sets;
+                # the others are dequeued in another order
+                both = set(a) & set(b)
+                if [x for x in a if x in both] != [x for x in b if x in both]:
+                    self.moved.update([old.index[str(x)] for x in both])
+
+    def neighbors(self, topo, kind, i):
+        return [topo.asn[x] for x in topo.adj[kind][i]]
+
+    def same_providers(self, a):
+        if a not in self.providers:
+            j = self.new.index.get(self.old.names[a])
+            self.providers[a] = j is not None and \
+                self.neighbors(self.old, topology.CP, a) == self.neighbors(self.new, topology.CP, j)
+        return self.providers[a]
+
+    def same_peers(self, a):
+        # a is in the new topology, see same_providers
+        if a not in self.peers:
+            j = self.new.index[self.old.names[a]]
+            self.peers[a] = [x for x in self.neighbors(self.old, topology.PP, a) if x in self.cone_asn] == \
+                [x for x in self.neighbors(self.new, topology.PP, j) if x in self.cone_asn]
+        return self.peers[a]
+
+    def unchanged(self, root):
+        if self.cone is None or root not in self.old:
+            return False
+        cone = topology.up_cone(self.old, [self.old.index[root]])
+        if not all([self.same_providers(a) for a in cone]):
+            return False
+        if not all([self.same_peers(a) for a in cone]):
+            return False
+        fixed = set(cone)
+        for a in cone:
+            fixed.update(self.old.adj[topology.PP][a])
+        return self.moved <= fixed
+
+# whether a cg_path output was tiebroken, None if it has no path at all
+def output_tiebreak(prev):
+    if isinstance(prev, pathstore.PathStore):
+        return prev.tiebreak
+    # a tiebroken path is a list of ASNs, otherwise a list of paths
+    for cl in prev:
+        for g in prev[cl]:
+            for d in prev[cl][g]:
+                if d:
+                    return not isinstance(d[0], list)
+    return None
+
+# the previous output and the reuse tests of both directions, for reusable()
+def load_previous(args, targets, tiebreak):
+    global previous
+    old = topology.load(args.prev_topology_file)
+    prev = pathstore.load(args.prev_output)
+    prev_tiebreak = output_tiebreak(prev)
+    if prev_tiebreak is not None and prev_tiebreak != tiebreak:
+        print("%s was computed with%s tiebreak" % (args.prev_output, "" if prev_tiebreak else "out"))
+        sys.exit(1)
+    # forward roots are guards with clients as sources and the other way round
+    previous = (prev, targets, [SnapshotDiff(old, topo, targets[0]),
+                                SnapshotDiff(old, topo, [g for g in targets[1] if g in topo])])
+
+# roots whose paths did not change, and the previous output has them all
+def reusable(direction, root):
+    prev, targets, diffs = previous
+    if not diffs[direction].unchanged(root):
+        return False
+    for source in targets[direction]:
+        cl, g = (source, root) if direction == 0 else (root, source)
+        if cl not in prev or g not in prev[cl]:
+            # dropped from the previous output
+            return False
+    return True
+
+# result of solve_root for a reusable root, from the previous output
+def carried_result(direction, root):
+    prev, targets, diffs = previous
+    result = []
+    for source in targets[direction]:
+        cl, g = (source, root) if direction == 0 else (root, source)
+        paths = prev[cl][g][direction]
+        result.append(paths if paths and source in topo else None)
+    return result
+
+# ASes of an endpoint file in order, without duplicates and those not in the topology
+def read_ases(filename):
+    ases = []
+    for line in open(filename):
+        if line.strip() in topo:
+            ases.append(line.strip())
+        elif line.strip():
+            print("%s not found in topology" % line.strip())
+    return list(dict.fromkeys(ases))
+
+# --study runs: one BFS per distinct root of all studies. A root's sources are
+# the union over the studies: the sources of a study for its destinations
+# (forward) and its destinations for its sources (reverse).
+def run_studies(args, stats):
+    global worker_args
+    studies = []
+    needed = {} # root -> {source: None}, in order
+    for spec in args.study:
+        name, src_file, dst_file = spec.split(':')
+        sources = read_ases(src_file)
+        dests = read_ases(dst_file)
+        studies.append((name, sources, dests))
+        for d in dests:
+            needed.setdefault(d, {}).update(dict.fromkeys(sources))
+        for s in sources:
+            needed.setdefault(s, {}).update(dict.fromkeys(dests))
+    print("%d roots for %d studies (%d without sharing)"
+          % (len(needed), len(studies), sum([len(st[1]) + len(st[2]) for st in studies])))
+
+    # roots with the same sources share one target list
+    targets = []
+    group = {}
+    tasks = []
+    for root in needed:
+        key = tuple(needed[root])
+        if key not in group:
+            group[key] = len(targets)
+            targets.append(list(key))
+        tasks.append((group[key], root))
+
+    tiebreak = not args.notiebreak
+    cache = None
+    if args.route_cache:
+        cache = RouteCache(args.route_cache, topo.digest, args.engine,
+                           args.route_cache_size * 1024 * 1024)
+    worker_args = (topo.cachefile, topo.digest, args.engine, tiebreak, targets, cache,
+                   bool(stats), args.debug)
+    init_worker(*worker_args)
+
+    stats.begin("routes")
+    start = time.time()
+    routes = {} # root -> {source: paths}
+    cached = 0
+    for gi, root, result, hit, work in run_roots(tasks, args):
+        cached += hit
+        stats.root(root, work)
+        routes[root] = dict(zip(targets[gi], result))
+    print("%d roots computed" % len(routes))
+    print(time.time() - start)
+    if cache is not None:
+        print("%d roots loaded from the route cache" % cached)
+        cache.evict()
+
+    stats.begin("dump")
+    for name, sources, dests in studies:
+        # Format: source: {destination: [forpath, revpath]}
+        out = {}
+        for s in sources:
+            out[s] = {}
+            for d in dests:
+                pair = [routes[d][s], routes[s][d]]
+                if pair[0] is None:
+                    print("forward path not found from %s to %s" % (s, d))
+                if pair[1] is None:
+                    print("reverse path not found from %s to %s" % (d, s))
+                out[s][d] = [p if p is not None else [] for p in pair]
+        if tiebreak:
+            # sources missing a path are dropped, as in the client/guard run
+            for s in [s for s in out if not all([p[0] and p[1] for p in out[s].values()])]:
+                out.pop(s)
+        if args.output_format == "binary":
+            pathstore.write('data/%s.bin' % name, out, tiebreak)
+        else:
+            with open('data/%s.json' % name, 'w+') as fp:
+                json.dump(out, fp)
+        print("%s: %d sources, %d destinations" % (name, len(out), len(dests)))
+    stats.add(studies=len(studies))
+
+def journal_entries(journal, targets):
+    # {guard: [forward, reverse]} of each client, in client file order
+    fwd_roots = [item for item in dict.fromkeys(targets[1]) if item in topo]
+    for ci, cl in enumerate(targets[0]):
+        entry = dict((g, [[],[]]) for g in targets[1])
+        for item in fwd_roots:
+            paths = journal.get_part((0, item), ci)
+            if paths is not None:
+                entry[item][0] = paths
             else:
-                asdict[asn1] = [[],[],[]]
-                asdict[asn1][rel+1] = [asn2]
-            if asn2 in asdict:
-                asdict[asn2][abs(rel)+1].append(asn1)
+                print("forward path not found from client %s to guard %s" % (cl,item))
+        for item, paths in zip(targets[1], journal.get((1, cl))):
+            if paths is not None:
+                entry[item][1] = paths
+            else:
+                print("reverse path not found from guard %s to client %s" % (item,cl))
+        yield cl, entry
+
+def write_journal(journal, targets, tiebreak, output_format):
+    # same output as the in-memory run, with one client entry in memory at a time
+    toberemoved = []
+    def complete(items):
+        for cl, entry in items:
+            if tiebreak and not all([p[0] and p[1] for p in entry.values()]):
+                toberemoved.append(cl)
             else:
-                asdict[asn2] = [[],[],[]]
-                asdict[asn2][abs(rel)+1] = [asn1]
+                yield cl, entry
+    if tiebreak:
+        print("performing tiebreak by router ID")
+    items = complete(journal_entries(journal, targets))
+    if output_format == "binary":
+        n = pathstore.write_items('data/cg_path.bin', items, list(dict.fromkeys(targets[1])), tiebreak)
+    else:
+        # same bytes as json.dump of the client dict
+        n = 0
+        with open('data/cg_path.json','w+') as fp:
+            fp.write('{')
+            for cl, entry in items:
+                fp.write('%s%s: %s' % (', ' if n else '', json.dumps(cl), json.dumps(entry)))
+                n += 1
+            fp.write('}')
+    if tiebreak:
+        print(toberemoved)
+    return n
+
+topo = None
+debug = False
+previous = None
+
+def main(args):
+    global topo, worker_args
+    stats = instrument.Stats(args.stats, "predictpath")
+    stats.begin("load")
+
+    # load AS relationships from the compiled CAIDA topology
+    # topo.adj[k][asn] = [provider-customer, peer-to-peer, customer-provider][k] edges
+    topo = topology.load(args.topology_file)
+    if args.study:
+        run_studies(args, stats)
+        stats.close()
+        return
 
     client_dict = {}
     g_lst = []
 
     for line in open(args.client_file):
-        if line.strip() in asdict:
+        if line.strip() in topo:
             client_dict[line.strip()] = {}
         else:
             print("%s not found in topology" % line.strip())
 
     for line in open(args.guard_as_file):
         g_lst.append(line.strip())
-        for cl in client_dict:
-            client_dict[cl][line.strip()] = [[],[]] #[forward,reverse]
+        # with --journal the entries are built one client at a time when writing
+        if not args.journal:
+            for cl in client_dict:
+                client_dict[cl][line.strip()] = [[],[]] #[forward,reverse]
 
     print("input file loading done. start forward path calculation now.")
 
@@ -195,68 +514,140 @@ def main(args):
     # {client: {guard: [[path1,path2],[path1,path2]]}} in which guard:[forward,reverse]
     # {dest: {exit: [[path1,path2],[path1,path2]]}} in which exit:[forward,reverse]
 
-    start = time.time()
+    tiebreak = not args.notiebreak
+    targets = [list(client_dict.keys()), g_lst]
+    cache = None
+    if args.route_cache:
+        cache = RouteCache(args.route_cache, topo.digest, args.engine,
+                           args.route_cache_size * 1024 * 1024)
+    worker_args = (topo.cachefile, topo.digest, args.engine, tiebreak, targets, cache,
+                   bool(stats), args.debug)
+    init_worker(*worker_args)
+    if args.prev_output:
+        load_previous(args, targets, tiebreak)
+    cached = 0
+    journal = None
+    if args.journal:
+        journal = Journal(args.journal, {"script": "predictpath", "topology": topo.digest,
+                                         "engine": args.engine, "tiebreak": tiebreak,
+                                         "targets": targets},
+                          args.resume)
+        if args.resume:
+            print("%d roots found in %s" % (len(journal), args.journal))
 
-    # first, we do forward: guard is the destination, and client is the source
-    for item in g_lst:
-        init(item)
-        bfs_cp(item)
-        bfs_pp(list(graph.keys()))
-        bfs_pc(list(graph.keys()))
-        # now, find the client sources
-        for cl in list(client_dict.keys()):
-            if cl in graph:
-                client_dict[cl][item][0] = graph[cl][1:]
+    # now, find the client sources
+    def put_forward(item, result):
+        for cl, paths in zip(targets[0], result):
+            if paths is not None:
+                client_dict[cl][item][0] = paths
             else:
                 print("forward path not found from client %s to guard %s" % (cl,item))
 
+    # now, find the guards
+    def put_reverse(cl, result):
+        for item, paths in zip(targets[1], result):
+            if paths is not None:
+                client_dict[cl][item][1] = paths
+            else:
+                print("reverse path not found from guard %s to client %s" % (item,cl))
+
+    stats.begin("forward")
+    start = time.time()
+
+    # first, we do forward: guard is the destination, and client is the source
+    tasks = []
+    carried = []
+    for item in dict.fromkeys(g_lst):
+        if item not in topo:
+            print("guard %s not found in topology" % item)
+        elif journal is not None and (0, item) in journal:
+            pass
+        elif previous is not None and reusable(0, item):
+            carried.append(item)
+        else:
+            tasks.append((0, item))
+    if previous is not None:
+        print("%d forward roots carried forward from the previous snapshot" % len(carried))
+        stats.add(carried=len(carried))
+    results = itertools.chain(((0, item, carried_result(0, item), False, None) for item in carried),
+                              run_roots(tasks, args))
+    for _, item, result, hit, work in results:
+        cached += hit
+        stats.root(item, work)
+        if journal is not None:
+            journal.append_parts((0, item), result)
+        else:
+            put_forward(item, result)
+
     end = time.time()
     print("forward calculation finished")
     print(end - start)
 
     # second, we do reverse: client is the destination, guard is the source
-    for cl in list(client_dict.keys()):
-        init(cl)
-        bfs_cp(cl)
-        bfs_pp(list(graph.keys()))
-        bfs_pc(list(graph.keys()))
-        # now, find the guards
-        for item in g_lst:
-            if item in graph:
-                client_dict[cl][item][1] = graph[item][1:]
-            else:
-                print("reverse path not found from guard %s to client %s" % (item,cl))
+    stats.begin("reverse")
+    tasks = []
+    carried = []
+    for cl in client_dict:
+        if journal is not None and (1, cl) in journal:
+            pass
+        elif previous is not None and reusable(1, cl):
+            carried.append(cl)
+        else:
+            tasks.append((1, cl))
+    if previous is not None:
+        print("%d reverse roots carried forward from the previous snapshot" % len(carried))
+        stats.add(carried=len(carried))
+    results = itertools.chain(((1, cl, carried_result(1, cl), False, None) for cl in carried),
+                              run_roots(tasks, args))
+    for _, cl, result, hit, work in results:
+        cached += hit
+        stats.root(cl, work)
+        if journal is not None:
+            journal.append((1, cl), result)
+        else:
+            put_reverse(cl, result)
 
     end = time.time()
     print("reverse calculation finished")
     print(end - start)
+    if cache is not None:
+        print("%d roots loaded from the route cache" % cached)
+        removed = cache.evict()
+        if removed:
+            print("%d route trees evicted from the cache" % removed)
+    if journal is not None:
+        # the results of this run and of the interrupted ones
+        stats.begin("dump")
+        n = write_journal(journal, targets, tiebreak, args.output_format)
+        journal.close()
+        stats.add(clients=n)
+        stats.close()
+        return
 
     # Format: client: {guard: [forpath, revpath]}
-    if not args.notiebreak:
+    # the tiebreak by router ID already picked one path per root
+    if tiebreak:
+        stats.begin("tiebreak")
         print("performing tiebreak by router ID")
         toberemoved = []
         for cl in client_dict:
-            ifcomplete = True
             for g in client_dict[cl]:
-                flst = client_dict[cl][g][0]
-                rlst = client_dict[cl][g][1]
-                if flst and rlst:
-                    newf = getPath(flst,0)
-                    newr = getPath(rlst,0)
-                    client_dict[cl][g] = [newf,newr]
-                else:
-                    ifcomplete = False
+                if not (client_dict[cl][g][0] and client_dict[cl][g][1]):
+                    toberemoved.append(cl)
                     break
-            if not ifcomplete:
-                toberemoved.append(cl)
         print(toberemoved)
         for c in toberemoved:
             client_dict.pop(c,None)
 
-    with open('data/cg_path.json','w+') as fp:
-        json.dump(client_dict,fp)
+    stats.begin("dump")
+    if args.output_format == "binary":
+        pathstore.write('data/cg_path.bin', client_dict, tiebreak)
+    else:
+        with open('data/cg_path.json','w+') as fp:
+            json.dump(client_dict,fp)
+    stats.add(clients=len(client_dict))
+    stats.close()
 
 
 if __name__ == '__main__':
     main(parse_args())
-
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##################################################
+# query_server.py
+# long-running query daemon keeping the pipeline inputs in memory
+# Input:
+# CAIDA AS topology (--topology_file, default="data/20161001.as-rel2.txt")
+# Predicted paths (--client_path, default="data/cg_path.json", or cg_path.bin)
+# Tor client to guard resiliences (--resil_file, default="data/cg_resilience.json",
+#   or cg_resilience.bin)
+# Guard bandwidths, adversary ASes and location ASes (--guard_path, --topas_file,
+#   data/cc_asn.json), for trace risk
+# Inputs that are missing only disable the queries that need them.
+# Protocol (Unix socket --socket, default="data/query.sock"):
+# one JSON object per line in each direction,
+#   {"op": ..., "args": {...}, "id": ...} -> {"id": ..., "result": ...} or {"id": ..., "error": ...}
+# ops:
+#   ping
+#   path, paths, on_path_ases    {"src", "dst"}   (PathOracle, see pathoracle.py)
+#   query                        {"pairs": [[src, dst], ...], "kind": "path"}
+#   cg_path                      {"client", "guard"} -> [forward, reverse]
+#   resilience                   {"client", "guard"} -> value, or the row without guard
+#   resilience_batch             {"pairs": [[client, guard], ...]}
+#   trace_risk                   {"trace": file} or {"locations": [code, ...]} or {"clients": [asn, ...]}
+#   batch                        {"requests": [{"op", "args"}, ...]} -> list of responses
+#   info                         loaded inputs and route tree cache counters
+# Connections are served concurrently; queries run one at a time on a worker
+# thread, since they share the route tree cache and module state.
+# Client library: common/queryclient.py
+##################################################
+
+import os
+import sys
+import json
+import stat
+import socket
+import signal
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+import guard_as_country
+from pathoracle import PathOracle
+import pathstore
+import resilstore
+import traces
+
+
+class QueryHandler(object):
+    def __init__(self, args):
+        self.oracle = PathOracle(args.topology_file, cache_size=args.cache_size)
+        self.oracle_all = PathOracle(topo=self.oracle.topo, all_paths=True, cache_size=args.cache_size)
+        print("%d ASes in topology" % len(self.oracle.topo))
+
+        self.store = None
+        self.risk = False
+        if os.path.exists(args.client_path):
+            if all(os.path.exists(f) for f in [args.guard_path, args.topas_file, 'data/cc_asn.json']):
+                # trace risk state of guard_as_country, including its path store
+                guard_as_country.load_shared(args)
+                self.store = guard_as_country.cg_path
+                self.risk = True
+            else:
+                self.store = pathstore.load(args.client_path)
+            print("%d clients in %s" % (len(self.store), args.client_path))
+        else:
+            print("%s not found, cg_path and trace_risk queries disabled" % args.client_path)
+
+        self.resil = None
+        if os.path.exists(args.resil_file):
+            client_dict = resilstore.load(args.resil_file)
+            if isinstance(client_dict, resilstore.ResilStore):
+                # the memory-mapped matrix
+                self.resil_clients = client_dict.cindex
+                self.resil_guards = client_dict.gindex
+                self.resil = client_dict.matrix
+            else:
+                self.resil_clients = dict(zip(client_dict.keys(), range(len(client_dict))))
+                guards = list(next(iter(client_dict.values())).keys()) if client_dict else []
+                self.resil_guards = dict(zip(guards, range(len(guards))))
+                self.resil = np.array([[row[g] for g in guards] for row in client_dict.values()],
+                                      dtype=np.float64).reshape(len(client_dict), len(guards))
+            print("%d x %d resiliences in %s" % (self.resil.shape + (args.resil_file,)))
+        else:
+            print("%s not found, resilience queries disabled" % args.resil_file)
+
+        self.ops = {
+            "ping": lambda: "pong",
+            "path": self.oracle.path,
+            "paths": self.oracle_all.paths,
+            "on_path_ases": lambda src, dst: sorted(self.oracle.on_path_ases(src, dst)),
+            "query": self.query,
+            "cg_path": self.cg_path,
+            "resilience": self.resilience,
+            "resilience_batch": self.resilience_batch,
+            "trace_risk": self.trace_risk,
+            "info": self.info,
+        }
+
+    def query(self, pairs, kind="path"):
+        oracle = self.oracle_all if kind == "paths" else self.oracle
+        res = oracle.query([tuple(p) for p in pairs], kind)
+        if kind == "on_path_ases":
+            res = [sorted(r) for r in res]
+        return res
+
+    def cg_path(self, client, guard):
+        if self.store is None:
+            raise ValueError("no path store loaded")
+        return self.store[client][guard]
+
+    def resilience(self, client, guard=None):
+        if self.resil is None:
+            raise ValueError("no resilience file loaded")
+        row = self.resil[self.resil_clients[client]]
+        if guard is None:
+            return dict(zip(self.resil_guards.keys(), row.tolist()))
+        return float(row[self.resil_guards[guard]])
+
+    def resilience_batch(self, pairs):
+        # None for unknown clients or guards
+        if self.resil is None:
+            raise ValueError("no resilience file loaded")
+        res = []
+        for client, guard in pairs:
+            ci = self.resil_clients.get(client)
+            gi = self.resil_guards.get(guard)
+            res.append(None if ci is None or gi is None else float(self.resil[ci][gi]))
+        return res
+
+    def trace_risk(self, trace=None, locations=None, clients=None):
+        # risk after each location, as in guard_as_country
+        if not self.risk:
+            raise ValueError("trace risk needs --client_path, --guard_path, --topas_file and data/cc_asn.json")
+        if trace is not None:
+            clients, _ = traces.locate(traces.load(trace), guard_as_country.cc_asn_d)
+        elif locations is not None:
+            cc_asn_d = guard_as_country.cc_asn_d
+            clients = [cc_asn_d[cc] for cc in locations if cc in cc_asn_d]
+        return guard_as_country.trace_risk(clients or []).tolist()
+
+    def info(self):
+        return {"ases": len(self.oracle.topo),
+                "clients": len(self.store) if self.store is not None else None,
+                "resilience": list(self.resil.shape) if self.resil is not None else None,
+                "trace_risk": self.risk,
+                "trees": {"cached": len(self.oracle.trees) + len(self.oracle_all.trees),
+                          "hits": self.oracle.hits + self.oracle_all.hits,
+                          "misses": self.oracle.misses + self.oracle_all.misses}}
+
+    def answer(self, request):
+        response = {"id": request.get("id")}
+        try:
+            if request.get("op") == "batch":
+                response["result"] = [self.answer(r) for r in request["args"]["requests"]]
+            else:
+                response["result"] = self.ops[request["op"]](**request.get("args", {}))
+        except KeyError as e:
+            response["error"] = "unknown %s" % e
+        except Exception as e:
+            response["error"] = "%s: %s" % (type(e).__name__, e)
+        return response
+
+    def handle_line(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return (json.dumps({"id": None, "error": "bad request: %s" % e}) + '\n').encode('utf-8')
+        return (json.dumps(self.answer(request)) + '\n').encode('utf-8')
+
+
+# a live daemon accepts connections on its socket, a stale one refuses them
+def socket_in_use(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except ConnectionRefusedError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+async def serve(args):
+    if os.path.exists(args.socket):
+        # never remove anything but a socket, e.g. a mistyped data file
+        if not stat.S_ISSOCK(os.stat(args.socket).st_mode):
+            print("%s exists and is not a socket" % args.socket)
+            sys.exit(1)
+        if socket_in_use(args.socket):
+            print("%s is in use by another daemon" % args.socket)
+            sys.exit(1)
+        os.remove(args.socket) # stale socket of a previous run
+    handler = QueryHandler(args)
+    pool = ThreadPoolExecutor(1)
+    loop = asyncio.get_running_loop()
+
+    async def connected(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(await loop.run_in_executor(pool, handler.handle_line, line))
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(connected, path=args.socket, limit=1 << 28)
+    stop = loop.create_future()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: stop.done() or stop.set_result(None))
+    print("listening on %s" % args.socket)
+    sys.stdout.flush()
+    async with server:
+        await stop
+    os.remove(args.socket)
+    pool.shutdown()
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default="data/query.sock")
+    parser.add_argument("--topology_file",
+                        default="data/20161001.as-rel2.txt")
+    parser.add_argument("--client_path",
+                        default="data/cg_path.json")
+    parser.add_argument("--resil_file",
+                        default="data/cg_resilience.json")
+    parser.add_argument("--guard_path",
+                        default="data/guard_as_bw.json")
+    parser.add_argument("--topas_file",
+                        default="data/top50ases.txt")
+    parser.add_argument("--cache_size", type=int, default=256,
+                        help="route trees kept in memory")
+    return parser.parse_args()
+
+def main(args):
+    asyncio.run(serve(args))
+
+
+if __name__ == '__main__':
+    main(parse_args())